@@ -1,26 +1,61 @@
-# from flask_admin import Admin
-# from flask_admin.contrib.sqla import ModelView
-# from flask_admin.model.form import InlineFormAdmin
-# from models import User, Folder, Password
+from flask import Response, request
+from flask_admin import Admin, AdminIndexView
+from flask_admin.contrib.sqla import ModelView
+from extensions import db
+from models import User, Folder, Password
+from config import Config
+import hmac
 
-# from app import db, app
+# Admin pages sit behind HTTP basic auth with the ADMIN_USERNAME and ADMIN_PASSWORD credentials
+def _authorized():
+    auth = request.authorization
+    if auth is None or auth.type != "basic" or not Config.ADMIN_PASSWORD:
+        return False
+    # Both are compared whatever the outcome of the first, so timing does not reveal which one was wrong
+    username_ok = hmac.compare_digest((auth.username or "").encode(), Config.ADMIN_USERNAME.encode())
+    password_ok = hmac.compare_digest((auth.password or "").encode(), Config.ADMIN_PASSWORD.encode())
+    return username_ok and password_ok
 
-# admin = Admin(app)
+def _challenge():
+    return Response("Admin login required", 401, {"WWW-Authenticate": 'Basic realm="admin"'})
 
-# # User Admin Model
-# class UserView(ModelView):
-#     column_hide_backrefs = False
-#     column_list = [ 'username', "email",'password',"folders", 'passwords'  ]
+class SecuredIndexView(AdminIndexView):
+    def is_accessible(self):
+        return _authorized()
 
-# # Folder Admin Model
-# class FolderView(ModelView):
-#     pass
+    def inaccessible_callback(self, name, **kwargs):
+        return _challenge()
 
-# #Password Admin Model
-# class PasswordView(ModelView):
-#     pass
+class SecuredModelView(ModelView):
+    def is_accessible(self):
+        return _authorized()
 
-# admin.add_view(UserView(User, db.session))
-# admin.add_view(PasswordView(Folder, db.session))
-# admin.add_view(FolderView(Password, db.session))
+    def inaccessible_callback(self, name, **kwargs):
+        return _challenge()
 
+# User Admin Model, password hashes and key salts are never shown or edited
+class UserView(SecuredModelView):
+    column_hide_backrefs = False
+    column_list = [ 'username', "email", "folders", 'passwords'  ]
+    column_exclude_list = ["password", "salt"]
+    form_excluded_columns = ["password", "salt", "vault_version", "key_version", "tombstones"]
+
+# Folder Admin Model
+class FolderView(SecuredModelView):
+    pass
+
+#Password Admin Model, entries are encrypted with the user's key so they can only be looked at
+class PasswordView(SecuredModelView):
+    can_create = False
+    can_edit = False
+    column_exclude_list = ["password"]
+
+# Adds the admin views to an app, only called when ADMIN_ENABLED is set
+def init_admin(app):
+    if not Config.ADMIN_PASSWORD:
+        raise RuntimeError("ADMIN_ENABLED needs ADMIN_PASSWORD to be set")
+    admin = Admin(app, index_view=SecuredIndexView())
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(FolderView(Folder, db.session))
+    admin.add_view(PasswordView(Password, db.session))
+    return admin
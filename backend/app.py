@@ -1,26 +1,22 @@
-from flask import Flask, jsonify, request
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.sql import func
-from flask_bcrypt import Bcrypt
-from flask_migrate import Migrate
-from flask_admin import Admin
+from flask import Flask, Response, current_app, g, jsonify, request, stream_with_context
 from config import Config
-from flask_admin.contrib.sqla import ModelView
+from extensions import db, bcrypt, jwt
+from routing import read_only
+import routing
 from flask_cors import CORS
-import pytz
 from flask_restful import Api, Resource
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_restful.representations.json import output_json
+from flask_jwt_extended import create_access_token, jwt_required, get_current_user, get_jwt
+import os
 import re
+import io
+import csv
+import json
+import weakref
 from datetime import datetime, timedelta
+from urllib.parse import quote
 
-
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-CORS(app)
-bcrypt = Bcrypt(app)
-jwt = JWTManager(app)
-api = Api(app, errors={
+api = Api(errors={
     'NoAuthorizationError': {
         'msg': "Missing Authorization Header",
         'status': 401,
@@ -29,22 +25,80 @@ api = Api(app, errors={
         'msg': "Token has expired",
         'status': 401,
     },
+    'RevokedTokenError': {
+        'msg': "Token has been revoked",
+        'status': 401,
+    },
+    'UserLookupError': {
+        'msg': "User not found",
+        'status': 400,
+    },
+    'PoolSaturated': {
+        'msg': "Server is busy, please try again",
+        'status': 503,
+    },
+    'ShardMoving': {
+        'msg': "Account is being moved, please try again shortly",
+        'status': 503,
+    },
 })
 
-app.app_context().push()
 from models import *
 from serializers import *
-# from admin import admin
 import utils
-
-migrate = Migrate(app, db)
+from keycache import get_user_key, key_cache
+import workers
+import instrumentation
+import ratelimit
+import compression
+import search
+import folder_tree
+import breach_index
+import audit
+import attachments
+import revocation
+from revocation import revocations
+from vault_cache import vault_cache
+import sharding
+
+instrumentation.add_collector(lambda: instrumentation.gauge_lines("key_cache", key_cache.stats()))
+instrumentation.add_collector(lambda: instrumentation.gauge_lines("hash_pool", workers.hash_pool.stats()))
+instrumentation.add_collector(lambda: instrumentation.gauge_lines("revocation", revocations.stats()))
+instrumentation.add_collector(lambda: instrumentation.gauge_lines("vault_cache", vault_cache.stats()))
+
+# Times JSON encoding of every API response
+@api.representation('application/json')
+def timed_output_json(data, code, headers=None):
+    with instrumentation.timed("json"):
+        return output_json(data, code, headers)
+
+# Rejects logged out tokens using the worker's cached copy of the revocation store
+@jwt.token_in_blocklist_loader
+def check_revoked(jwt_header, jwt_data):
+    return revocations.is_revoked(jwt_data)
+
+# Stamps new tokens with their exact issue time, checked against "log out everywhere" revocations
+jwt.additional_claims_loader(revocation.token_claims)
+
+# Loads the user for a token once per request by primary key
+@jwt.user_lookup_loader
+def load_user(jwt_header, jwt_data):
+    user_id = g.user_id = jwt_data.get("uid")
+
+    # Tokens issued before ids were added carry the username instead
+    if user_id is None:
+        return sharding.find_user(str(jwt_data["sub"]))
+
+    sharding.select_for_token(jwt_data)
+
+    return db.session.get(User, user_id)
 
 # Checks if token is still valid and returns username
 class Check_Token(Resource):
+    @read_only
     @jwt_required()
     def get(self):
-        current_user = get_jwt_identity()
-        return {"username": current_user}, 200
+        return {"username": get_current_user().username}, 200
 
 # Gives token to frontend if user credentials are correct
 class Login(Resource):
@@ -57,9 +111,15 @@ class Login(Resource):
         # Makes sure none of the inputs are blank
         if not username or not password:
             return {"msg": "Username and password are required"}, 400
+        if not isinstance(username, str) or not isinstance(password, str):
+            return {"msg": "Username and password must be strings"}, 400
+
+        # Turns away bursts of guesses before any database or bcrypt work
+        if Config.LOGIN_RATE_LIMIT_ENABLED and not ratelimit.allow_login(request.remote_addr, username):
+            return {"msg": "Too many login attempts, try again later"}, 429, {"Retry-After": str(Config.LOGIN_RATE_WINDOW)}
 
         # Checks if user inputs match user information
-        user = User.query.filter(func.lower(User.username) == func.lower(username)).first()
+        user = sharding.find_user(username)
 
         if user and user.failed_attempts >= 20:
             return {"msg": "Account Locked"}, 400
@@ -67,10 +127,11 @@ class Login(Resource):
         if user and user.locked_until > datetime.now():
             return {"msg": str(user.locked_until)}, 400
 
-        if user and bcrypt.check_password_hash(user.password, password):
+        if user and workers.check_password(user.password, password):
             user.failed_attempts = 0
-            access_token = create_access_token(identity=user.username)
-            decryption_key = str((utils.derive_key(user.password, bytes.fromhex(user.salt)).hex()))
+            db.session.commit()
+            access_token = create_access_token(identity=str(user.id), additional_claims=sharding.token_claims(user))
+            decryption_key = str(get_user_key(user).hex())
             return {"access_token": access_token, "user": user.username, "decryption_key": decryption_key}
         else:
             if user:
@@ -81,13 +142,19 @@ class Login(Resource):
                     user.locked_until = datetime.now() + timedelta(hours=1)
                 if user.failed_attempts == 15:
                     user.locked_until = datetime.now() + timedelta(hours=2)
+                # The session is discarded at the end of each request, so the count has to be committed
+                db.session.commit()
 
             return {"msg": "Username or password is incorrect"}, 400
         
-@app.route("/")
 def index():
     return '<h1>Working</h1>'
 
+# Reports hashing pool queue depth and wait times
+@instrumentation.metrics_access
+def pool_stats():
+    return jsonify(workers.hash_pool.stats())
+
 # Lets users create an account
 class Register(Resource):
     def post(self):
@@ -100,13 +167,15 @@ class Register(Resource):
         # Makes sure none of the inputs are blank
         if not username or not email or not password or not passwordConfirm:
             return {"msg": "all fields required"}, 400
+        if not all(isinstance(value, str) for value in (username, email, password, passwordConfirm)):
+            return {"msg": "all fields must be strings"}, 400
 
         # Makes sure the username input is valid
         if len(username) < 3:
             return {"msg": "Username must be 3 characters or greater"}, 400
         if len(username) > 25:
             return {"msg": "Username cannot be greater than 25 characters"}, 400
-        if (User.query.filter(func.lower(User.username) == func.lower(username)).first() is not None):
+        if sharding.username_taken(username):
             return {"msg": "Username is already in use."}, 400
         
         # Makes sure the email input is valid
@@ -126,7 +195,7 @@ class Register(Resource):
             return {"msg": "Passwords must match"}, 400
         
         # Hashes new password and creates an account
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        hashed_password = workers.hash_password(password, current_app.config.get("BCRYPT_LOG_ROUNDS", 12))
         new_user = User(username=username, email=email, password=hashed_password)
         db.session.add(new_user)
         db.session.commit()
@@ -136,32 +205,240 @@ class Register(Resource):
 
 # Returns a list of passwords
 class PasswordList(Resource):
+    @read_only
     @jwt_required()
     def get(self):
-        current_user = get_jwt_identity()
-        user = User.query.filter(func.lower(User.username) == func.lower(current_user)).first()
+        user = get_current_user()
 
         # Makes sure user actually exists
         if not user:
             return {"msg": "User not found"}, 400
 
-        # Serializes the folders and passwords
-        folders = [serialize_folder(folder) for folder in user.folders]
-        passwords = [serialize_password(password) for password in user.passwords]
+        # Clients opt into the compact row format through the Accept header
+        compact = request.accept_mimetypes.best_match(["application/json", COMPACT_MIMETYPE]) == COMPACT_MIMETYPE
+        etag = f"{user.etag}-compact" if compact else user.etag
+        headers = {"ETag": f'W/"{etag}"', "Vary": "Accept, Accept-Encoding"}
+
+        # Skips all serialization if the client already has this version of the vault
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+
+        # Serves the encoded and compressed body cached for this version of the vault when there is one
+        encoding = compression.choose_encoding(request.accept_encodings) if Config.COMPRESS_ENABLED else None
+        variant = f"{'compact' if compact else 'json'}:{encoding}"
+        mimetype = COMPACT_MIMETYPE if compact else "application/json"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
+        body = vault_cache.get(user.id, user.vault_version, variant) if Config.VAULT_CACHE_ENABLED else None
+        if body is not None:
+            return Response(body, mimetype=mimetype, headers=headers)
+
+        # Loads the whole vault up front so serializing doesn't lazy load per folder
+        version = user.vault_version
+        folders, passwords = user.load_vault()
+
+        if compact:
+            with instrumentation.timed("serialize"):
+                data = {
+                    "fields": COMPACT_FIELDS,
+                    "folders": [serialize_folder_row(folder) for folder in folders],
+                    "passwords": [serialize_password_row(password) for password in passwords]
+                }
+            with instrumentation.timed("json"):
+                body = dumps_compact(data)
+        else:
+            # Serializes the folders and passwords
+            with instrumentation.timed("serialize"):
+                folders = [serialize_folder(folder) for folder in folders]
+                passwords = [serialize_password(password) for password in passwords]
+            data = {
+                "folders": folders,
+                "passwords": passwords
+            }
+            body = timed_output_json(data, 200).get_data()
+
+        # Compresses even small vaults since the work is done once per version rather than once per request
+        if encoding:
+            with instrumentation.timed("compress"):
+                body = compression.compress_as(body, encoding)
+
+        if Config.VAULT_CACHE_ENABLED:
+            vault_cache.put(user.id, version, variant, body)
+        return Response(body, mimetype=mimetype, headers=headers)
+
+# Returns only the folders, passwords and deletions since a client's sync token
+class Sync(Resource):
+    @read_only
+    @jwt_required()
+    def get(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        since = request.args.get("since", 0, type=int)
+
+        # Skips all serialization if nothing changed since the client's last sync
+        if request.if_none_match.contains_weak(user.etag) or since >= user.vault_version:
+            return Response(status=304, headers={"ETag": f'W/"{user.etag}"'})
+
+        folders = Folder.query.filter(Folder.user_id == user.id, Folder.version > since).order_by(Folder.id).all()
+        passwords = Password.owned_by(user.id).filter(Password.version > since).order_by(Password.id).all()
+        tombstones = Tombstone.query.filter(Tombstone.user_id == user.id, Tombstone.version > since).all()
+
         data = {
-            "folders": folders,
-            "passwords": passwords
+            "sync_token": user.vault_version,
+            "folders": [serialize_folder_meta(folder) for folder in folders],
+            "passwords": [dict(serialize_password(password), folder_id=password.folder_id) for password in passwords],
+            "deleted": {
+                "folders": [tombstone.item_id for tombstone in tombstones if tombstone.kind == "folder"],
+                "passwords": [tombstone.item_id for tombstone in tombstones if tombstone.kind == "password"]
+            }
         }
 
-        return data, 200
+        return data, 200, {"ETag": f'W/"{user.etag}"'}
+
+# Returns one page of passwords ordered by (folder_id, id) with optional filters
+class PasswordPage(Resource):
+    @read_only
+    @jwt_required()
+    def get(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        cursor = request.args.get("cursor")
+        limit = request.args.get("limit", Config.PAGE_SIZE_DEFAULT, type=int)
+        folder_id = request.args.get("folder_id")
+        created_after = request.args.get("created_after")
+        created_before = request.args.get("created_before")
+
+        # Makes sure the page size is valid
+        if limit < 1 or limit > Config.PAGE_SIZE_MAX:
+            return {"msg": f"Limit must be between 1 and {Config.PAGE_SIZE_MAX}"}, 400
+
+        # Makes sure the folder filter is valid, "none" selects unfiled passwords
+        if folder_id and folder_id != "none" and not folder_id.isdigit():
+            return {"msg": "Folder id invalid"}, 400
+
+        # Filters by created date range
+        filters = []
+        try:
+            if created_after:
+                filters.append(Password.created_at >= datetime.fromisoformat(created_after))
+            if created_before:
+                filters.append(Password.created_at < datetime.fromisoformat(created_before))
+        except ValueError:
+            return {"msg": "Dates must be in ISO format"}, 400
+
+        # Continues after the last row of the previous page, unfiled passwords sort first under folder position 0
+        after_folder, after_id = 0, 0
+        if cursor:
+            position = utils.decode_cursor(cursor)
+            if not position or len(position) != 2:
+                return {"msg": "Cursor invalid"}, 400
+            after_folder, after_id = position
+
+        # Reads unfiled passwords, then foldered ones, as two ranges that each follow an index, so neither query sorts.
+        # One extra row is fetched to know if there is another page.
+        rows = []
+        if after_folder == 0 and folder_id in (None, "", "none"):
+            rows = (
+                Password.query.filter(Password.user_id == user.id, Password.id > after_id, *filters)
+                .order_by(Password.id).limit(limit + 1).all()
+            )
+            after_id = 0
+
+        if len(rows) <= limit and folder_id != "none":
+            query = Password.query.filter(
+                Password.folder_id.in_(db.select(Folder.id).where(Folder.user_id == user.id)),
+                db.tuple_(Password.folder_id, Password.id) > (after_folder, after_id),
+                *filters
+            )
+            if folder_id:
+                query = query.filter(Password.folder_id == int(folder_id))
+            rows += query.order_by(Password.folder_id, Password.id).limit(limit + 1 - len(rows)).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        next_cursor = None
+        if has_more:
+            next_cursor = utils.encode_cursor(rows[-1].folder_id or 0, rows[-1].id)
+
+        passwords = [dict(serialize_password(password), folder_id=password.folder_id) for password in rows]
+
+        return {"passwords": passwords, "next_cursor": next_cursor}, 200
+
+# Searches a user's account names and usernames, best matches first
+class Search(Resource):
+    @read_only
+    @jwt_required()
+    def get(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        query = request.args.get("q", "")
+        limit = request.args.get("limit", Config.PAGE_SIZE_DEFAULT, type=int)
+        offset = request.args.get("offset", 0, type=int)
+
+        # Makes sure the search and page are valid
+        if not query.strip():
+            return {"msg": "Search query required"}, 400
+        if len(query) > 100:
+            return {"msg": "Search query must be below 100 characters"}, 400
+        if limit < 1 or limit > Config.PAGE_SIZE_MAX:
+            return {"msg": f"Limit must be between 1 and {Config.PAGE_SIZE_MAX}"}, 400
+        if offset < 0:
+            return {"msg": "Offset must be 0 or greater"}, 400
+
+        rows, has_more = search.search_passwords(user.id, query, limit, offset)
+        passwords = [dict(serialize_password(password), folder_id=password.folder_id) for password in rows]
+
+        return {"passwords": passwords, "next_offset": offset + limit if has_more else None}, 200
+
+# Lists breached hashes sharing a five character SHA-1 prefix, so the password itself never leaves the client
+class BreachCheck(Resource):
+    @jwt_required()
+    def get(self):
+        prefix = request.args.get("prefix", "")
+
+        # Makes sure the prefix is five hex characters
+        if not re.fullmatch(r"[0-9a-fA-F]{5}", prefix):
+            return {"msg": "Prefix must be 5 hex characters"}, 400
+
+        index = breach_index.get_index()
+        if index is None:
+            return {"msg": "Breach checks are not available"}, 503
+
+        return {"suffixes": index.range(prefix.upper())}, 200
+
+# Revokes the current token, or every token the user holds when all is true
+class Logout(Resource):
+    @jwt_required()
+    def post(self):
+        token = get_jwt()
+        data = request.get_json(silent=True) or {}
+
+        revocations.revoke(token)
+        if data.get("all") and token.get("uid") is not None:
+            revocations.revoke_user(token["uid"])
+
+        return {"msg": "Logged out succesfully!"}, 200
 
 # Lets user's create, update, and delete passwords
 class Passwords(Resource):
     # Lets user create a account if they have a valid jwt token
     @jwt_required()
     def post(self):
-        current_user = get_jwt_identity()
-        user = User.query.filter(func.lower(User.username) == func.lower(current_user)).first()
+        user = get_current_user()
         
         # Makes sure user actually exists
         if not user:
@@ -173,22 +450,18 @@ class Passwords(Resource):
         password = data.get("password")
         folder_id = data.get('folder_id', None)
 
-        # Makes sure none of the input is blank
-        if not account_name or not username or not password:
-            return {"msg": "All fields are required"}, 400
-
         # Makes sure the account_name, username, and password are valid
-        if len(account_name) > 50:
-            return {"msg": "Account name must be below 50 characters"}, 400
-        if len(username) > 50:
-            return {"msg": "Username must be below 50 characters"}, 400
-        if len(password) > 50:
-            return {"msg": "Password must be below 50 characters"}, 400
-        
+        error = utils.validate_account(account_name, username, password)
+        if error:
+            return {"msg": error}, 400
+
+        # Warns about passwords found in the breach index before they are encrypted
+        warning = breach_index.breach_warning(password)
+
         # Creates a encryption key and encrypts new password
-        key = utils.derive_key(user.password, bytes.fromhex(user.salt))
-        password = utils.encrypt(password, key)
-        new_password = Password(account_name=account_name, username=username, password=password)
+        key = get_user_key(user)
+        password = utils.encrypt(password, key, Config.VAULT_GCM)
+        new_password = Password(account_name=account_name, username=username, password=password, key_version=user.key_version, version=user.bump_version())
 
         # Makes sure the user is the one who owns the account
         if folder_id:
@@ -203,13 +476,12 @@ class Passwords(Resource):
         db.session.add(new_password)
         db.session.commit()
 
-        return {"msg": "Account added succesfully!"}, 200
+        return {"msg": "Account added succesfully!", "warning": warning}, 200
     
     # Lets user update a account if they have a valid jwt token
     @jwt_required()
     def patch(self):
-        current_user = get_jwt_identity()
-        user = User.query.filter(func.lower(User.username) == func.lower(current_user)).first()
+        user = get_current_user()
 
         # Makes sure the user exists
         if not user:
@@ -222,17 +494,14 @@ class Passwords(Resource):
         password = data.get("password")
 
         # Makes sure none of the inputs blank
-        if not account_name or not username or not password or not password_id:
+        if not password_id:
             return {"msg": "All fields are required"}, 400
-        
+
         # Makes sure the account_name, username, and password are valid
-        if len(account_name) > 50:
-            return {"msg": "Account name must be below 50 characters"}, 400
-        if len(username) > 50:
-            return {"msg": "Username must be below 50 characters"}, 400
-        if len(password) > 50:
-            return {"msg": "Password must be below 50 characters"}, 400
-        
+        error = utils.validate_account(account_name, username, password)
+        if error:
+            return {"msg": error}, 400
+
         # Grabs account to be changed
         changedPass = Password.query.get(password_id)
     
@@ -246,23 +515,27 @@ class Passwords(Resource):
         elif changedPass.folder and changedPass.folder.user != user:
             return {"msg": "You do not own this account"}, 400
         
+        # Warns about passwords found in the breach index before they are encrypted
+        warning = breach_index.breach_warning(password)
+
         # Creates encryption key and encrypts new password
-        key = utils.derive_key(user.password, bytes.fromhex(user.salt))
-        password = utils.encrypt(password, key)
+        key = get_user_key(user)
+        password = utils.encrypt(password, key, Config.VAULT_GCM)
 
         changedPass.account_name = account_name
         changedPass.username = username
         changedPass.password = password
+        changedPass.key_version = user.key_version
+        changedPass.version = user.bump_version()
 
         db.session.commit()
 
-        return {"msg": "Account updated succesfully!"},200
+        return {"msg": "Account updated succesfully!", "warning": warning},200
     
     # Lets user delete a account if they have a valid jwt token
     @jwt_required()
     def delete(self):
-        current_user = get_jwt_identity()
-        user = User.query.filter(func.lower(User.username) == func.lower(current_user)).first()
+        user = get_current_user()
 
         # Makes sure user exists
         if not user:
@@ -283,23 +556,394 @@ class Passwords(Resource):
             return {"msg": "Item not found"}, 400
         
         # Makes sure user is actually the owner
-        if itemToDelete.user and itemToDelete.user == user:
-            db.session.delete(itemToDelete)
-        elif itemToDelete.folder and itemToDelete.folder.user == user:
-            db.session.delete(itemToDelete)
-        else:
+        owner = itemToDelete.user or (itemToDelete.folder and itemToDelete.folder.user)
+        if owner != user:
             return {"msg":"You are not the owner of this item"}, 400
+
+        user.add_tombstone("password", itemToDelete.id, user.bump_version())
+        db.session.delete(itemToDelete)
         db.session.commit()
 
         return {"msg": "Deletion was successful"}, 200
 
+# Applies a list of password and folder operations in one all-or-nothing transaction
+class Batch(Resource):
+    @jwt_required()
+    def post(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        data = request.get_json()
+        operations = data.get("operations")
+
+        # Makes sure the batch is a non empty list within the size limit
+        if not isinstance(operations, list) or not operations:
+            return {"msg": "Operations required"}, 400
+        if len(operations) > Config.BATCH_MAX_OPERATIONS:
+            return {"msg": f"Batches cannot have more than {Config.BATCH_MAX_OPERATIONS} operations"}, 400
+        if not all(isinstance(operation, dict) for operation in operations):
+            return {"msg": "Operations must be objects"}, 400
+
+        # Makes sure ids are integers and text fields are strings before any of them are used
+        for index, operation in enumerate(operations):
+            for field in ("id", "folder_id", "parent_id"):
+                value = operation.get(field)
+                if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+                    return {"msg": f"{field} must be an integer", "index": index}, 400
+            for field in ("name", "account_name", "username", "password"):
+                if operation.get(field) is not None and not isinstance(operation.get(field), str):
+                    return {"msg": f"{field} must be a string", "index": index}, 400
+
+        # Loads every referenced password, then every folder they or the operations touch, with one IN query each
+        password_ids = {operation.get("id") for operation in operations if operation.get("type") == "password" and operation.get("id")}
+        passwords = {password.id: password for password in Password.query.filter(Password.id.in_(password_ids))}
+        folder_ids = {operation.get("id") for operation in operations if operation.get("type") == "folder" and operation.get("id")}
+        folder_ids |= {operation.get("folder_id") for operation in operations if operation.get("folder_id")}
+        folder_ids |= {operation.get("parent_id") for operation in operations if operation.get("parent_id")}
+        folder_ids |= {password.folder_id for password in passwords.values() if password.folder_id}
+        folders = {folder.id: folder for folder in Folder.query.filter(Folder.id.in_(folder_ids), Folder.user_id == user.id)}
+
+        version = user.bump_version()
+        key = None
+        created = []
+
+        for index, operation in enumerate(operations):
+            op = operation.get("op")
+            kind = operation.get("type")
+            item_id = operation.get("id")
+            error = None
+
+            if kind == "password":
+                password = passwords.get(item_id)
+                folder_id = operation.get("folder_id") or None
+
+                # Makes sure the user owns the account being changed
+                if op != "create" and (not password or (password.user_id != user.id and password.folder_id not in folders)):
+                    error = "Account not found or not owned by user"
+                # Makes sure the user owns the folder the account goes into
+                elif op in ("create", "move") and folder_id is not None and folder_id not in folders:
+                    error = "Folder not found or not owned by user"
+                elif op in ("create", "update"):
+                    error = utils.validate_account(operation.get("account_name"), operation.get("username"), operation.get("password"))
+
+                if not error:
+                    if op in ("create", "update") and key is None:
+                        key = get_user_key(user)
+
+                    if op == "create":
+                        password = Password(account_name=operation["account_name"], username=operation["username"], password=utils.encrypt(operation["password"], key, Config.VAULT_GCM), key_version=user.key_version, version=version)
+                        password.user_id = None if folder_id else user.id
+                        password.folder_id = folder_id
+                        db.session.add(password)
+                        created.append((index, password))
+                    elif op == "update":
+                        password.account_name = operation["account_name"]
+                        password.username = operation["username"]
+                        password.password = utils.encrypt(operation["password"], key, Config.VAULT_GCM)
+                        password.key_version = user.key_version
+                        password.version = version
+                    elif op == "move":
+                        password.user_id = None if folder_id else user.id
+                        password.folder_id = folder_id
+                        password.version = version
+                    elif op == "delete":
+                        user.add_tombstone("password", password.id, version)
+                        db.session.delete(password)
+                        del passwords[password.id]
+                    else:
+                        error = "Operation invalid"
+
+            elif kind == "folder":
+                folder = folders.get(item_id)
+                name = operation.get("name")
+                parent_id = operation.get("parent_id") or None
+
+                # Makes sure the user owns the folder being changed
+                if op != "create" and not folder:
+                    error = "Folder not found or not owned by user"
+                # Makes sure the folder name is valid
+                elif op in ("create", "update") and not name:
+                    error = "Folder name required"
+                elif op in ("create", "update") and len(name) > 50:
+                    error = "Name must be below 50 characters"
+                # Makes sure the user owns the parent folder
+                elif op in ("create", "move") and parent_id is not None and parent_id not in folders:
+                    error = "Folder not found or not owned by user"
+                elif op == "create" and parent_id is not None and folder_tree.depth(parent_id) + 1 > Config.FOLDER_MAX_DEPTH:
+                    error = f"Folders cannot be nested more than {Config.FOLDER_MAX_DEPTH} levels deep"
+                elif op == "create":
+                    folder = Folder(name=name, user_id=user.id, parent_id=parent_id, version=version)
+                    db.session.add(folder)
+                    created.append((index, folder))
+                elif op == "update":
+                    folder.name = name
+                    folder.version = version
+                elif op == "move":
+                    try:
+                        folder_tree.move_subtree(folder, folders.get(parent_id))
+                        folder.version = version
+                    except ValueError as move_error:
+                        error = str(move_error)
+                elif op == "delete":
+                    folder_ids, password_ids = folder_tree.delete_subtree(user, folder, version)
+                    for deleted_id in folder_ids:
+                        folders.pop(deleted_id, None)
+                    for deleted_id in password_ids:
+                        passwords.pop(deleted_id, None)
+                else:
+                    error = "Operation invalid"
+
+            else:
+                error = "Type must be password or folder"
+
+            # Undoes every operation in the batch if one fails
+            if error:
+                db.session.rollback()
+                return {"msg": error, "index": index}, 400
+
+        db.session.commit()
+
+        return {"msg": "Batch applied succesfully!", "created": [{"index": index, "id": item.id} for index, item in created]}, 200
+
+# Imports many accounts from a streamed CSV or JSON lines body
+class Import(Resource):
+    @jwt_required()
+    def post(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        # Reads rows straight off the request stream so large files aren't buffered
+        stream = io.TextIOWrapper(request.stream, encoding="utf-8")
+        if request.mimetype == "text/csv":
+            rows = csv.DictReader(stream)
+        elif request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            rows = (line for line in stream if line.strip())
+        else:
+            return {"msg": "Body must be text/csv or application/x-ndjson"}, 415
+
+        # Derives the key and loads folder ownership once for the whole import
+        key = get_user_key(user)
+        folder_ids = {folder_id for (folder_id,) in db.session.query(Folder.id).filter_by(user_id=user.id)}
+
+        imported = 0
+        errors = []
+        chunk = []
+
+        # Stops at a body that isn't UTF-8 or a malformed CSV line, so the rows before it still get a report
+        unreadable = []
+        def read_rows():
+            try:
+                yield from rows
+            except (UnicodeDecodeError, csv.Error) as error:
+                unreadable.append(error)
+
+        row_number = 0
+        for row_number, row in enumerate(read_rows(), start=1):
+            if isinstance(row, str):
+                try:
+                    row = json.loads(row)
+                except ValueError:
+                    row = None
+                if not isinstance(row, dict):
+                    errors.append({"row": row_number, "msg": "Row is not a valid JSON object"})
+                    continue
+
+            account_name = row.get("account_name")
+            username = row.get("username")
+            password = row.get("password")
+            folder_id = row.get("folder_id") or None
+
+            # Makes sure JSON rows hold text, a number or list here would fail validation and lose the rest of the import
+            if not all(isinstance(value, str) for value in (account_name, username, password) if value is not None):
+                errors.append({"row": row_number, "msg": "account_name, username and password must be strings"})
+                continue
+
+            # Makes sure the account_name, username, and password are valid
+            error = utils.validate_account(account_name, username, password)
+            if error:
+                errors.append({"row": row_number, "msg": error})
+                continue
+
+            # Makes sure the user owns the folder
+            if folder_id is not None:
+                folder_id = int(folder_id) if str(folder_id).isdigit() else None
+                if folder_id not in folder_ids:
+                    errors.append({"row": row_number, "msg": "Folder not found or not owned by user"})
+                    continue
+
+            chunk.append({
+                "account_name": account_name,
+                "username": username,
+                "password": password,
+                "user_id": None if folder_id else user.id,
+                "folder_id": folder_id
+            })
+
+            if len(chunk) >= Config.IMPORT_CHUNK_SIZE:
+                imported += self.insert_chunk(user, key, chunk)
+                chunk = []
+
+        if chunk:
+            imported += self.insert_chunk(user, key, chunk)
+
+        if unreadable:
+            errors.append({"row": row_number + 1, "msg": f"Row could not be read, it and every row after it were not imported: {unreadable[0]}"})
+
+        return {"imported": imported, "errors": errors}, 200
+
+    # Encrypts a chunk of rows with one key setup, inserts them in one multi-row statement and commits
+    @staticmethod
+    def insert_chunk(user, key, chunk):
+        version = user.bump_version()
+        ciphertexts = utils.encrypt_many([row["password"] for row in chunk], key, Config.VAULT_GCM)
+        for row, ciphertext in zip(chunk, ciphertexts):
+            row["password"] = ciphertext
+            row["key_version"] = user.key_version
+            row["version"] = version
+        db.session.execute(db.insert(Password), chunk)
+        db.session.commit()
+        return len(chunk)
+
+# Streams every account a user owns as JSON lines
+class Export(Resource):
+    @jwt_required()
+    def get(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        query = Password.owned_by(user.id).order_by(Password.id)
+
+        # Yields rows as the database returns them instead of building the whole vault
+        def generate():
+            for password in query.yield_per(Config.EXPORT_BATCH_SIZE):
+                yield json.dumps(dict(serialize_password(password), folder_id=password.folder_id)) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# Lets user list, upload and delete files attached to their accounts
+class Attachments(Resource):
+    @read_only
+    @jwt_required()
+    def get(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        query = Attachment.query.filter_by(user_id=user.id)
+        password_id = request.args.get("password_id", type=int)
+        if password_id is not None:
+            query = query.filter_by(password_id=password_id)
+
+        return {
+            "attachments": [serialize_attachment(attachment) for attachment in query.order_by(Attachment.id)],
+            "used": attachments.usage(user.id),
+            "quota": Config.ATTACHMENT_QUOTA
+        }, 200
+
+    # Takes the file as the raw request body so it can be encrypted as it arrives
+    @jwt_required()
+    def post(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        password_id = request.args.get("password_id", type=int)
+        name = os.path.basename((request.args.get("name") or "").replace("\\", "/"))
+        content_type = request.mimetype or "application/octet-stream"
+
+        # Makes sure input is valid
+        if not password_id or not name:
+            return {"msg": "Account and file name required"}, 400
+        if len(name) > 255:
+            return {"msg": "File name must be below 255 characters"}, 400
+        if len(content_type) > 100:
+            content_type = "application/octet-stream"
+
+        # Makes sure user owns the account
+        password = db.session.get(Password, password_id)
+        owner = password and (password.user or (password.folder and password.folder.user))
+        if owner != user:
+            return {"msg": "Account not found or not owned by user"}, 400
+
+        try:
+            attachment = attachments.save(user, password, name, content_type, request.stream, request.content_length)
+        except attachments.QuotaExceeded as error:
+            return {"msg": str(error)}, 413
+
+        return {"msg": "Attachment added succesfully!", "attachment": serialize_attachment(attachment)}, 200
+
+    @jwt_required()
+    def delete(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        attachment = db.session.get(Attachment, request.args.get("id", type=int))
+        if not attachment or attachment.user_id != user.id:
+            return {"msg": "Attachment not found"}, 400
+
+        attachments.delete([attachment])
+        db.session.commit()
+
+        return {"msg": "Deletion was successful"}, 200
+
+# Streams a decrypted attachment, or the part of it asked for with a Range header
+class AttachmentDownload(Resource):
+    @read_only
+    @jwt_required()
+    def get(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        attachment = db.session.get(Attachment, request.args.get("id", type=int))
+        if not attachment or attachment.user_id != user.id:
+            return {"msg": "Attachment not found"}, 400
+
+        size = attachment.size
+        start, stop, status = 0, size, 200
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(attachment.name)}"
+        }
+
+        # Serves single ranges only, clients asking for several get the whole file
+        if request.range is not None and len(request.range.ranges) == 1:
+            bounds = request.range.range_for_length(size)
+            if bounds is None:
+                return Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+            start, stop = bounds
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        headers["Content-Length"] = str(stop - start)
+
+        chunks = attachments.read_range(attachment.blob, size, attachments.file_key(user, attachment), start, stop)
+        # Passed through untouched so compression never buffers the file
+        return Response(chunks, status=status, mimetype=attachment.content_type, headers=headers, direct_passthrough=True)
+
 # Lets user create folders to store and organize passwords    
 class Folders(Resource):
     # Lets user great folders
     @jwt_required()
     def post(self):
-        current_user = get_jwt_identity()
-        user = User.query.filter(func.lower(User.username) == func.lower(current_user)).first()
+        user = get_current_user()
 
         # Makes sure user actually exists
         if not user:
@@ -307,6 +951,7 @@ class Folders(Resource):
         
         data = request.get_json()
         name = data.get("name")
+        parent_id = data.get("parent_id")
 
         # Makes sure input isn't blank
         if not name:
@@ -315,8 +960,16 @@ class Folders(Resource):
         # Makes sure input is valid
         if len(name) > 50:
             return {"msg": "Name must be below 50 characters"}, 400
-        
-        new_folder = Folder(name=name, user_id=user.id)
+
+        # Makes sure the user owns the parent folder and it has room for another level
+        if parent_id:
+            parent = db.session.get(Folder, parent_id)
+            if not parent or parent.user_id != user.id:
+                return {"msg": "Folder not found or not owned by user"}, 400
+            if folder_tree.depth(parent.id) + 1 > Config.FOLDER_MAX_DEPTH:
+                return {"msg": f"Folders cannot be nested more than {Config.FOLDER_MAX_DEPTH} levels deep"}, 400
+
+        new_folder = Folder(name=name, user_id=user.id, parent_id=parent_id or None, version=user.bump_version())
         db.session.add(new_folder)
         db.session.commit()
 
@@ -325,8 +978,7 @@ class Folders(Resource):
     # Lets user update folder names
     @jwt_required()
     def patch(self):
-        current_user = get_jwt_identity()
-        user = User.query.filter(func.lower(User.username) == func.lower(current_user)).first()
+        user = get_current_user()
 
         # Makes sure user actually exists
         if not user:
@@ -335,13 +987,14 @@ class Folders(Resource):
         data = request.get_json()
         folder_id = data.get("id")
         folder_name = data.get("name")
+        moving = "parent_id" in data
 
-        # Makes sure none of the inputs are blank
-        if not folder_name or not folder_id:
+        # Makes sure none of the inputs are blank, a move doesn't need a new name
+        if not folder_id or (not folder_name and not moving):
             return {"msg": "All fields are required"}, 400
         
         # Makes sure the inputs are valid
-        if len(folder_name) > 50:
+        if folder_name and len(folder_name) > 50:
             return {"msg": "Folder name must be below 50 characters"}, 400
       
         # Grabs that folder that is going to be updated
@@ -355,7 +1008,22 @@ class Folders(Resource):
         if not changedFolder.user or not changedFolder.user == user:
             return {"msg": "You do not own this folder"}, 400
         
-        changedFolder.name = folder_name
+        # Moves the folder and everything below it, a null parent_id moves it to the top level
+        if moving:
+            parent = None
+            if data["parent_id"]:
+                parent = db.session.get(Folder, data["parent_id"])
+                if not parent or parent.user_id != user.id:
+                    return {"msg": "Folder not found or not owned by user"}, 400
+            try:
+                folder_tree.move_subtree(changedFolder, parent)
+            except ValueError as error:
+                db.session.rollback()
+                return {"msg": str(error)}, 400
+
+        if folder_name:
+            changedFolder.name = folder_name
+        changedFolder.version = user.bump_version()
         db.session.commit()
 
         return {"msg": "Folder updated succesfully!"},200
@@ -363,8 +1031,7 @@ class Folders(Resource):
     # Lets user delete folders
     @jwt_required()
     def delete(self):
-        current_user = get_jwt_identity()
-        user = User.query.filter(func.lower(User.username) == func.lower(current_user)).first()
+        user = get_current_user()
 
         # Makes sure user actually exists
         if not user:
@@ -386,19 +1053,54 @@ class Folders(Resource):
         
         # Makes sure user is actually the owner
         if itemToDelete.user == user:
-            db.session.delete(itemToDelete)
+            folder_tree.delete_subtree(user, itemToDelete, user.bump_version())
             db.session.commit()
         else:
             return {"msg":"You are not the owner of this item"}, 400
         
         return {"msg": "Deletion was successful"}, 200
 
+# Gets a folder and everything nested below it, or the user's whole folder tree
+class FolderTree(Resource):
+    @read_only
+    @jwt_required()
+    def get(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        folder_id = request.args.get("id")
+
+        # Makes sure the user owns the folder
+        if folder_id:
+            folder = db.session.get(Folder, folder_id) if folder_id.isdigit() else None
+            if not folder or folder.user_id != user.id:
+                return {"msg": "Folder not found or not owned by user"}, 400
+            folder_id = folder.id
+
+        return {"folders": folder_tree.subtree(user.id, folder_id)}, 200
+
+# Reports reused, weak, breached and old passwords in a user's vault
+class Audit(Resource):
+    @read_only
+    @jwt_required()
+    def get(self):
+        user = get_current_user()
+
+        # Makes sure user actually exists
+        if not user:
+            return {"msg": "User not found"}, 400
+
+        return audit.audit_vault(user), 200
+
 # Gets all user profile information
 class GetProfile(Resource):
+    @read_only
     @jwt_required()
     def get(self):
-        current_user = get_jwt_identity()
-        user = User.query.filter(func.lower(User.username) == func.lower(current_user)).first()
+        user = get_current_user()
 
         # Makes sure user actually exists
         if not user:
@@ -407,23 +1109,16 @@ class GetProfile(Resource):
         # Grabs user information
         username = user.username
         email = user.email
-        folder_count = Folder.query.filter_by(user_id=user.id).count()
-        account_count = Password.query.filter_by(user_id=user.id).count()
-
-        # Adds accounts in folder to account_count
-        for folder in user.folders:
-            account_count += folder.count_passwords()
-
+        stats = user.vault_stats()
         created = user.created_at.strftime('%Y-%m-%d %H:%M:%S'),
 
-        return {"username": username, "email": email, "folder_count": folder_count, "account_count": account_count, "created": created}, 200
+        return {"username": username, "email": email, "folder_count": stats["folder_count"], "account_count": stats["account_count"], "folder_counts": stats["folder_counts"], "created": created}, 200
     
 # Lets user update user information
 class Profile(Resource):
     @jwt_required()
     def patch(self):
-        current_user = get_jwt_identity()
-        user = User.query.filter(func.lower(User.username) == func.lower(current_user)).first()
+        user = get_current_user()
 
         # Makes sure user actually exists
         if not user:
@@ -439,7 +1134,7 @@ class Profile(Resource):
         if len(username) > 25:
             return {"msg": "Username cannot be greater than 25 characters"}, 400
         if (username.lower() != user.username.lower()):
-            if (User.query.filter(func.lower(User.username) == func.lower(username)).first() is not None ):
+            if sharding.username_taken(username):
                 return {"msg": "Username is already in use."}, 400
         
         # Makes sure the email input is valid
@@ -457,13 +1152,78 @@ class Profile(Resource):
 api.add_resource(Register, '/api/register')
 api.add_resource(Check_Token, '/api/check_token')
 api.add_resource(Login, '/api/login')
+api.add_resource(Logout, '/api/logout')
 api.add_resource(PasswordList, '/api/password_list')
+api.add_resource(PasswordPage, '/api/password_page')
+api.add_resource(Sync, '/api/sync')
+api.add_resource(Search, '/api/search')
+api.add_resource(BreachCheck, '/api/breach_check')
 api.add_resource(Passwords, '/api/passwords')
+api.add_resource(Attachments, '/api/attachments')
+api.add_resource(AttachmentDownload, '/api/attachment_download')
 api.add_resource(Folders, '/api/folders')
+api.add_resource(FolderTree, '/api/folder_tree')
+api.add_resource(Batch, '/api/batch')
+api.add_resource(Import, '/api/import')
+api.add_resource(Export, '/api/export')
+api.add_resource(Audit, '/api/audit')
 api.add_resource(GetProfile, '/api/get_profile')
 api.add_resource(Profile, '/api/profile')
 
 
 
+# Builds the app, loading admin and migration support only when they are enabled
+def create_app(config=Config):
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    # Takes the client address from the trusted proxies' X-Forwarded-For, so limits key on clients, not proxies
+    if app.config["TRUSTED_PROXY_COUNT"]:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXY_COUNT"], x_proto=app.config["TRUSTED_PROXY_COUNT"])
+
+    db.init_app(app)
+    CORS(app)
+    bcrypt.init_app(app)
+    jwt.init_app(app)
+    api.init_app(app)
+    app.add_url_rule("/", "index", index)
+    app.add_url_rule("/api/pool_stats", "pool_stats", pool_stats)
+
+    # Adds per request timing, Server-Timing headers and /metrics
+    if app.config["METRICS_ENABLED"]:
+        instrumentation.init_app(app)
+
+    # Compresses large responses for clients that accept gzip or brotli
+    compression.init_app(app)
+
+    # Keeps clients that just wrote reading from the primary
+    routing.init_app(app)
+
+    if app.config["MIGRATE_ENABLED"]:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    if app.config["ADMIN_ENABLED"]:
+        from admin import init_admin
+        init_admin(app)
+
+    _apps.add(app)
+
+    return app
+
+# Apps built in this process, held weakly so building one does not keep it alive forever
+_apps = weakref.WeakSet()
+
+# Server workers forked after an app was built must open their own connections
+def _dispose_engines():
+    for app in list(_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=_dispose_engines)
+
+
 if __name__=="__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,262 @@
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import event
+from sqlalchemy.sql import func
+from extensions import db
+from routing import RoutingSession
+from models import Attachment, Password
+from keycache import get_user_key
+from config import Config
+import argparse
+import contextlib
+import os
+import struct
+import time
+import uuid
+import sharding
+import utils
+
+# File layout: header, then the contents encrypted in fixed size AES-GCM chunks
+#   header  MAGIC + plaintext chunk size (uint32) + random nonce prefix (8 bytes)
+#   chunk n encrypted with nonce prefix + n (uint32), the last chunk is authenticated as the last,
+#   so a reordered, dropped or truncated chunk fails to decrypt
+MAGIC = b"VAULTATT1"
+HEADER = struct.Struct("<9sI8s")
+TAG_SIZE = 16
+LAST_CHUNK = b"last"
+
+# Blobs younger than this are never swept, they may belong to an upload that has not committed yet
+SWEEP_MIN_AGE = 3600
+
+# Raised when an upload would go over the file size limit or the user's quota
+class QuotaExceeded(Exception):
+    pass
+
+# Attachment contents as files under a directory, written whole before they become visible
+class FilesystemStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, blob):
+        return os.path.join(self.root, blob[:2], blob)
+
+    # File to write a new blob to, moved into place only if the block finishes
+    @contextlib.contextmanager
+    def writer(self, blob):
+        path = self.path(blob)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = path + ".tmp"
+        try:
+            with open(temporary_path, "wb") as file:
+                yield file
+            os.replace(temporary_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporary_path)
+            raise
+
+    def open(self, blob):
+        return open(self.path(blob), "rb")
+
+    def delete(self, blob):
+        self.remove_file(self.path(blob))
+
+    def remove_file(self, path):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+    # Every stored file, unfinished uploads included, as (name, path, modification time)
+    def files(self):
+        if not os.path.isdir(self.root):
+            return
+        for directory in os.scandir(self.root):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    yield entry.name, entry.path, entry.stat().st_mtime
+
+store = FilesystemStore(Config.ATTACHMENT_PATH)
+
+def _nonce(prefix, index):
+    return prefix + struct.pack(">I", index)
+
+# Reads exactly size bytes unless the stream ends first
+def _read_full(stream, size):
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+# Bytes of attachments a user has stored
+def usage(user_id):
+    return db.session.execute(
+        db.select(func.coalesce(func.sum(Attachment.size), 0)).where(Attachment.user_id == user_id)
+    ).scalar()
+
+# Encrypts a stream into a new blob one chunk at a time, returning the plaintext size
+def _write_blob(blob, stream, file_key, limit, chunk_size):
+    aesgcm = AESGCM(file_key)
+    prefix = os.urandom(8)
+    size = 0
+    index = 0
+
+    with store.writer(blob) as file:
+        file.write(HEADER.pack(MAGIC, chunk_size, prefix))
+
+        # Reads one chunk ahead so the last chunk is known when it is encrypted
+        chunk = _read_full(stream, chunk_size)
+        while True:
+            size += len(chunk)
+            if size > limit:
+                raise QuotaExceeded
+            following = _read_full(stream, chunk_size) if len(chunk) == chunk_size else b""
+            last = not following
+            file.write(aesgcm.encrypt(_nonce(prefix, index), chunk, LAST_CHUNK if last else None))
+            if last:
+                return size
+            chunk = following
+            index += 1
+
+def _limit_message(used):
+    if Config.ATTACHMENT_QUOTA - used < Config.ATTACHMENT_MAX_SIZE:
+        return f"Attachment quota of {Config.ATTACHMENT_QUOTA:,} bytes exceeded, {max(Config.ATTACHMENT_QUOTA - used, 0):,} bytes left"
+    return f"Attachments cannot be larger than {Config.ATTACHMENT_MAX_SIZE:,} bytes"
+
+# Streams an upload into an encrypted blob and records it against the user's quota
+def save(user, password, name, content_type, stream, content_length=None):
+    used = usage(user.id)
+    limit = min(Config.ATTACHMENT_MAX_SIZE, Config.ATTACHMENT_QUOTA - used)
+    if content_length is not None and content_length > limit:
+        raise QuotaExceeded(_limit_message(used))
+
+    # Ends the read transaction so no database locks are held while the file streams in
+    user_id, password_id = user.id, password.id
+    db.session.commit()
+
+    file_key = AESGCM.generate_key(bit_length=256)
+    blob = uuid.uuid4().hex
+    try:
+        size = _write_blob(blob, stream, file_key, limit, Config.ATTACHMENT_CHUNK_SIZE)
+    except QuotaExceeded:
+        raise QuotaExceeded(_limit_message(used)) from None
+
+    try:
+        # Bumping the version locks the user row, so concurrent uploads check the quota one at a time
+        version = user.bump_version()
+        used = usage(user_id)
+        if used + size > Config.ATTACHMENT_QUOTA:
+            raise QuotaExceeded(_limit_message(used))
+
+        attachment = Attachment(
+            user_id=user_id,
+            password_id=password_id,
+            name=name,
+            content_type=content_type,
+            size=size,
+            blob=blob,
+            key=utils.encrypt(file_key.hex(), get_user_key(user), gcm=True),
+            version=version
+        )
+        db.session.add(attachment)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        store.delete(blob)
+        raise
+    return attachment
+
+# Decrypts the plaintext bytes [start, stop) of a blob holding size bytes, reading only the chunks that cover them
+def read_range(blob, size, key, start, stop):
+    aesgcm = AESGCM(key)
+    with store.open(blob) as file:
+        magic, chunk_size, prefix = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{blob} is not an encrypted attachment")
+
+        last_index = max(size - 1, 0) // chunk_size
+        index = start // chunk_size
+        file.seek(HEADER.size + index * (chunk_size + TAG_SIZE))
+        position = index * chunk_size
+
+        while True:
+            chunk = aesgcm.decrypt(
+                _nonce(prefix, index),
+                file.read(chunk_size + TAG_SIZE),
+                LAST_CHUNK if index == last_index else None
+            )
+            yield chunk[start - position if start > position else 0:stop - position]
+            position += chunk_size
+            if index == last_index or position >= stop:
+                return
+            index += 1
+
+# An attachment's own key, unwrapped with the user's vault key
+def file_key(user, attachment):
+    return bytes.fromhex(utils.decrypt(attachment.key, get_user_key(user)))
+
+# Blobs are removed only once the transaction deleting their rows commits
+def _delete_blobs_after_commit(session, blobs):
+    session.info.setdefault("deleted_blobs", []).extend(blobs)
+
+@event.listens_for(RoutingSession, "after_commit")
+def _after_commit(session):
+    for blob in session.info.pop("deleted_blobs", []):
+        store.delete(blob)
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("deleted_blobs", None)
+
+# Deletes attachments, their files follow on commit
+def delete(attachments):
+    _delete_blobs_after_commit(db.session, [attachment.blob for attachment in attachments])
+    for attachment in attachments:
+        db.session.delete(attachment)
+
+# Deletes every attachment of the given passwords, used where passwords are deleted in bulk
+def delete_for_passwords(password_ids, session=db.session):
+    # Runs on the connection so it can be called mid flush
+    connection = session.connection(bind_arguments={"mapper": Attachment})
+    where = Attachment.password_id.in_(password_ids)
+    blobs = connection.execute(db.select(Attachment.blob).where(where)).scalars().all()
+    if blobs:
+        connection.execute(db.delete(Attachment).where(where))
+        _delete_blobs_after_commit(session, blobs)
+
+# Takes a password's attachments with it when the password is deleted through the session
+@event.listens_for(RoutingSession, "before_flush")
+def _delete_with_passwords(session, flush_context, instances):
+    password_ids = [obj.id for obj in session.deleted if isinstance(obj, Password)]
+    if password_ids:
+        delete_for_passwords(password_ids, session)
+
+# Removes blobs no attachment row points at, left behind by crashed uploads or failed deletes
+def sweep(min_age=SWEEP_MIN_AGE, progress=print):
+    known = set()
+    for shard in sharding.each_shard():
+        with sharding.use_shard(shard):
+            known.update(db.session.execute(db.select(Attachment.blob)).scalars())
+
+    cutoff = time.time() - min_age
+    removed = 0
+    for name, path, modified in list(store.files()):
+        if name not in known and modified < cutoff:
+            store.remove_file(path)
+            removed += 1
+            progress(f"removed {name}")
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain encrypted attachment files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sweep_command = commands.add_parser("sweep", help="remove files no attachment points at")
+    sweep_command.add_argument("--min-age", type=int, default=SWEEP_MIN_AGE, help="seconds a file must be untouched")
+    args = parser.parse_args()
+
+    from app import create_app
+    with create_app().app_context():
+        print(f"Removed {sweep(args.min_age)} files")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+from extensions import db
+from models import User, Password
+from keycache import get_user_key
+from config import Config
+from datetime import datetime, timedelta, timezone
+import argparse
+import hashlib
+import math
+import multiprocessing
+import breach_index
+import sharding
+import utils
+
+# Strength scores from 0 (very weak) to 4 (very strong) by estimated entropy bits
+SCORE_BITS = (28, 36, 60, 128)
+
+# Characters pools a password draws from, used to estimate its entropy
+POOLS = (
+    (str.islower, 26),
+    (str.isupper, 26),
+    (str.isdigit, 10),
+)
+SYMBOL_POOL = 33
+
+# Scores a password by its length and the character pools it uses, with repeats counting once
+def score_password(password):
+    chars = set(password)
+    pool = sum(size for test, size in POOLS if any(test(char) for char in chars))
+    if any(not char.isalnum() for char in chars):
+        pool += SYMBOL_POOL
+    if not pool:
+        return 0
+
+    bits = len(chars) * math.log2(pool) + (len(password) - len(chars))
+    return sum(bits >= threshold for threshold in SCORE_BITS)
+
+def _decrypt_chunk(rows, key):
+    try:
+        return utils.decrypt_many([row.password for row in rows], key)
+    except ValueError:
+        # Finds which rows are unreadable instead of failing the whole chunk
+        plaintexts = []
+        for row in rows:
+            try:
+                plaintexts.append(utils.decrypt(row.password, key))
+            except ValueError:
+                plaintexts.append(None)
+        return plaintexts
+
+# Decrypts a user's vault once in chunks and reports reused, weak, breached, old and unreadable entries
+def audit_vault(user, chunk_size=Config.EXPORT_BATCH_SIZE):
+    key = get_user_key(user)
+    # Stored timestamps are naive UTC
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=Config.AUDIT_MAX_AGE_DAYS)
+    # Digest of each distinct password mapped to its ids, score and breach count
+    buckets = {}
+    scores = [0] * (len(SCORE_BITS) + 1)
+    weak, breached, old, unreadable = [], [], [], []
+    total = 0
+
+    # Streams plain rows in chunks so only one chunk is held at a time
+    statement = Password.owned_by(user.id) \
+        .with_entities(Password.id, Password.password, Password.created_at, Password.updated_at) \
+        .order_by(Password.id) \
+        .statement.execution_options(yield_per=chunk_size)
+    for rows in db.session.execute(statement).partitions():
+        total += len(rows)
+        for row, plaintext in zip(rows, _decrypt_chunk(rows, key)):
+            if plaintext is None:
+                unreadable.append(row.id)
+                continue
+
+            # Buckets by digest so reuse is found in one pass without keeping plaintexts around
+            digest = hashlib.sha256(plaintext.encode("utf-8")).digest()
+            bucket = buckets.get(digest)
+            if bucket is None:
+                # Scores and breach checks run once per distinct password
+                bucket = buckets[digest] = ([], score_password(plaintext), breach_index.breach_count(plaintext))
+            ids, score, count = bucket
+            ids.append(row.id)
+
+            scores[score] += 1
+            if score < Config.AUDIT_WEAK_SCORE:
+                weak.append({"id": row.id, "score": score})
+            if count:
+                breached.append({"id": row.id, "count": count})
+
+            # A password's age is counted from when it was last changed
+            if (row.updated_at or row.created_at) < cutoff:
+                old.append(row.id)
+
+    reused = sorted((ids for ids, _, _ in buckets.values() if len(ids) > 1), key=len, reverse=True)
+    return {
+        "total": total,
+        "reused": reused,
+        "reused_count": sum(len(ids) for ids in reused),
+        "weak": weak,
+        "breached": breached,
+        "old": old,
+        "unreadable": unreadable,
+        "scores": scores
+    }
+
+# One line summary of a report for the CLI
+def summarize(user_id, report):
+    return (
+        f"user {user_id}: {report['total']} entries, {report['reused_count']} reused in {len(report['reused'])} groups, "
+        f"{len(report['weak'])} weak, {len(report['breached'])} breached, {len(report['old'])} old, {len(report['unreadable'])} unreadable"
+    )
+
+def _audit_user(user_id, shard):
+    with sharding.use_shard(shard):
+        user = db.session.get(User, user_id)
+        report = audit_vault(user)
+        db.session.remove()
+    return user_id, report
+
+# Builds one app per pool process, so connections are never shared with the parent and tasks reuse them
+def _init_process():
+    from app import create_app
+    global _process_context
+    _process_context = create_app().app_context()
+    _process_context.push()
+
+def _audit_in_process(target):
+    return _audit_user(*target)
+
+# Audits every user, one process per user at a time when workers is above one
+def audit_all(workers=1):
+    targets = []
+    for shard in sharding.each_shard():
+        with sharding.use_shard(shard):
+            targets += [(user_id, shard) for (user_id,) in db.session.query(User.id).order_by(User.id)]
+    if workers <= 1 or len(targets) <= 1:
+        yield from (_audit_user(*target) for target in targets)
+        return
+
+    db.session.remove()
+    with multiprocessing.get_context("fork").Pool(workers, initializer=_init_process) as pool:
+        yield from pool.imap_unordered(_audit_in_process, targets)
+
+def main():
+    parser = argparse.ArgumentParser(description="Report reused, weak, breached and old vault passwords")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user", help="username to audit")
+    target.add_argument("--all", action="store_true", help="audit every user")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    from app import create_app
+    with create_app().app_context():
+        if args.user:
+            user = sharding.find_user(args.user)
+            if user is None:
+                parser.error(f"{args.user} not found")
+            print(summarize(user.id, audit_vault(user)))
+        else:
+            for user_id, report in audit_all(args.workers):
+                print(summarize(user_id, report))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from common import configure
+
+# Streams a large file through the attachment endpoints and reports throughput and peak Python memory
+def main():
+    parser = argparse.ArgumentParser(description="Attachment upload and download streaming")
+    parser.add_argument("--megabytes", type=int, default=100)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="vault-bench-")
+    os.environ.setdefault("ATTACHMENT_PATH", os.path.join(directory, "attachments"))
+    os.environ.setdefault("ATTACHMENT_MAX_SIZE", str((args.megabytes + 1) * 1024 * 1024))
+    os.environ.setdefault("ATTACHMENT_QUOTA", str((args.megabytes + 1) * 1024 * 1024))
+    os.environ.setdefault("HASH_POOL_WORKERS", "0")
+    os.environ.setdefault("LOGIN_RATE_LIMIT_ENABLED", "false")
+    configure(os.path.join(directory, "bench.db"))
+    from app import create_app
+    from extensions import db
+
+    app = create_app()
+    app.app_context().push()
+    db.create_all()
+    client = app.test_client()
+
+    client.post("/api/register", json={"username": "bench", "email": "bench@example.com", "password": "Password1!", "passwordConfirm": "Password1!"})
+    token = client.post("/api/login", json={"username": "bench", "password": "Password1!"}).json["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/api/passwords", json={"account_name": "bench", "username": "bench", "password": "bench"}, headers=headers)
+
+    source = os.path.join(directory, "source.bin")
+    with open(source, "wb") as file:
+        for _ in range(args.megabytes):
+            file.write(os.urandom(1024 * 1024))
+    size = os.path.getsize(source)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(source, "rb") as file:
+        response = client.post("/api/attachments?password_id=1&name=source.bin", input_stream=file, headers=dict(headers, **{"Content-Length": str(size)}))
+    upload_seconds = time.perf_counter() - start
+    upload_peak = tracemalloc.get_traced_memory()[1]
+    attachment_id = response.json["attachment"]["id"]
+
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    downloaded = 0
+    response = client.get(f"/api/attachment_download?id={attachment_id}", headers=headers, buffered=False)
+    for chunk in response.response:
+        downloaded += len(chunk)
+    download_seconds = time.perf_counter() - start
+    download_peak = tracemalloc.get_traced_memory()[1]
+
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    response = client.get(f"/api/attachment_download?id={attachment_id}", headers=dict(headers, Range=f"bytes={size // 2}-{size // 2 + 4095}"))
+    range_ms = (time.perf_counter() - start) * 1000
+    tracemalloc.stop()
+
+    print(json.dumps({
+        "bytes": size,
+        "upload_mb_per_s": round(size / upload_seconds / 1e6, 1),
+        "upload_peak_kb": upload_peak // 1024,
+        "download_mb_per_s": round(downloaded / download_seconds / 1e6, 1),
+        "download_peak_kb": download_peak // 1024,
+        "range_4kb_ms": round(range_ms, 3),
+        "range_status": response.status_code,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from common import configure, measure
+
+# Builds a synthetic index of random hashes and times the build and mmap lookups
+def main():
+    parser = argparse.ArgumentParser(description="Breach index build and lookup latency")
+    parser.add_argument("--hashes", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=10000)
+    args = parser.parse_args()
+
+    configure()
+    import breach_index
+
+    digests = sorted(os.urandom(20) for _ in range(args.hashes))
+    path = os.path.join(tempfile.mkdtemp(prefix="vault-bench-"), "breach.idx")
+
+    start = time.perf_counter()
+    breach_index.build((f"{digest.hex().upper()}:1".encode() for digest in digests), path)
+    build_seconds = time.perf_counter() - start
+
+    index = breach_index.BreachIndex(path)
+    hits = iter(digests[:args.repeat] * 2)
+    misses = iter([os.urandom(20) for _ in range(args.repeat)] * 2)
+
+    print(json.dumps({
+        "hashes": args.hashes,
+        "file_bytes": os.path.getsize(path),
+        "build_seconds": round(build_seconds, 3),
+        "lookup_hit": measure(lambda: index.lookup(next(hits)), args.repeat),
+        "lookup_miss": measure(lambda: index.lookup(next(misses)), args.repeat),
+        "range": measure(lambda: index.range("ABCDE"), args.repeat),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Points the app at a throwaway SQLite database unless one is configured
+def configure(database_path=None):
+    if not database_path:
+        database_path = os.path.join(tempfile.mkdtemp(prefix="vault-bench-"), "bench.db")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{database_path}")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("JWT_KEY", "benchmark-jwt-key-that-is-long-enough")
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+# Runs fn repeatedly and returns latency statistics in milliseconds
+def measure(fn, repeat=100, warmup=5):
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "median_ms": round(samples[len(samples) // 2], 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+    }
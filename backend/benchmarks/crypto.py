@@ -0,0 +1,35 @@
+import argparse
+import json
+import os
+
+from common import configure, measure
+
+# Compares per value encryption with the batch APIs for both ciphertext formats
+def main():
+    parser = argparse.ArgumentParser(description="Vault encryption throughput per batch of entries")
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    configure()
+    import utils
+
+    key = os.urandom(32)
+    passwords = [f"Password{n}!" for n in range(args.entries)]
+    cbc = utils.encrypt_many(passwords, key)
+    gcm = utils.encrypt_many(passwords, key, gcm=True)
+
+    results = {
+        "entries": args.entries,
+        "encrypt_loop_cbc": measure(lambda: [utils.encrypt(password, key) for password in passwords], args.repeat, 1),
+        "encrypt_many_cbc": measure(lambda: utils.encrypt_many(passwords, key), args.repeat, 1),
+        "encrypt_many_gcm": measure(lambda: utils.encrypt_many(passwords, key, gcm=True), args.repeat, 1),
+        "decrypt_loop_cbc": measure(lambda: [utils.decrypt(ciphertext, key) for ciphertext in cbc], args.repeat, 1),
+        "decrypt_many_cbc": measure(lambda: utils.decrypt_many(cbc, key), args.repeat, 1),
+        "decrypt_many_gcm": measure(lambda: utils.decrypt_many(gcm, key), args.repeat, 1),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+
+from common import configure, measure
+
+# Compares payload size and fetch time of the JSON and compact password_list formats
+def main():
+    parser = argparse.ArgumentParser(description="password_list payload size and encode time per format")
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault("HASH_POOL_WORKERS", "0")
+    os.environ.setdefault("LOGIN_RATE_LIMIT_ENABLED", "false")
+    # Measures building each response, vault_list_cache.py measures serving them from the cache
+    os.environ.setdefault("VAULT_CACHE_ENABLED", "false")
+    configure()
+    from app import create_app
+    from extensions import db, bcrypt
+    import models
+    import utils
+    from run import seed_vault
+    import serializers
+    from serializers import COMPACT_MIMETYPE
+
+    app = create_app()
+    app.app_context().push()
+    db.create_all()
+    client = app.test_client()
+    password_hash = bcrypt.generate_password_hash("BenchPassword1!").decode("utf-8")
+    variants = {
+        "json": {},
+        "json_gzip": {"Accept-Encoding": "gzip"},
+        "json_br": {"Accept-Encoding": "br"},
+        "compact": {"Accept": COMPACT_MIMETYPE},
+        "compact_gzip": {"Accept": COMPACT_MIMETYPE, "Accept-Encoding": "gzip"},
+        "compact_br": {"Accept": COMPACT_MIMETYPE, "Accept-Encoding": "br"},
+    }
+    results = []
+
+    for size in (int(size) for size in args.sizes.split(",")):
+        user_id = seed_vault(db, models, utils, size, password_hash)
+
+        # Serialization plus encoding alone, without the ORM load or HTTP round trip
+        folders, passwords = db.session.get(models.User, user_id).load_vault()
+        encoders = {
+            "json": lambda: json.dumps({
+                "folders": [serializers.serialize_folder(folder) for folder in folders],
+                "passwords": [serializers.serialize_password(password) for password in passwords]
+            }),
+            "compact": lambda: serializers.dumps_compact({
+                "fields": serializers.COMPACT_FIELDS,
+                "folders": [serializers.serialize_folder_row(folder) for folder in folders],
+                "passwords": [serializers.serialize_password_row(password) for password in passwords]
+            }),
+        }
+        for name, encode in encoders.items():
+            results.append(dict(measure(encode, args.repeat, 1), entries=size, format=name, stage="encode", bytes=len(encode())))
+        db.session.expunge_all()
+        token = client.post("/api/login", json={"username": f"bench{size}", "password": "BenchPassword1!"}).get_json()["access_token"]
+
+        for name, headers in variants.items():
+            headers = dict(headers, Authorization=f"Bearer {token}")
+            response = client.get("/api/password_list", headers=headers)
+            results.append(dict(
+                measure(lambda: client.get("/api/password_list", headers=headers), args.repeat, 1),
+                entries=size,
+                format=name,
+                stage="request",
+                content_encoding=response.headers.get("Content-Encoding"),
+                bytes=len(response.data)
+            ))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import sys
+
+from common import configure, measure
+
+# Seeds one user with a vault of the given size, a tenth of it spread across folders
+def seed_vault(db, models, utils, size, password_hash):
+    user = models.User(username=f"bench{size}", email=f"bench{size}@example.com", password=password_hash)
+    db.session.add(user)
+    db.session.commit()
+
+    folder_count = max(1, size // 100)
+    db.session.execute(db.insert(models.Folder), [{"name": f"Folder {n}", "user_id": user.id} for n in range(folder_count)])
+    db.session.commit()
+    folder_ids = [folder_id for (folder_id,) in db.session.query(models.Folder.id).filter_by(user_id=user.id)]
+
+    # Reuses one ciphertext so seeding large vaults doesn't time the cipher
+    ciphertext = utils.encrypt("Password123!", os.urandom(32))
+    rows = []
+    for n in range(size):
+        folder_id = folder_ids[n % folder_count] if n % 10 == 0 else None
+        rows.append({
+            "account_name": f"Account {n}",
+            "username": f"user{n}@example.com",
+            "password": ciphertext,
+            "user_id": None if folder_id else user.id,
+            "folder_id": folder_id
+        })
+        if len(rows) == 10000:
+            db.session.execute(db.insert(models.Password), rows)
+            rows = []
+    if rows:
+        db.session.execute(db.insert(models.Password), rows)
+    db.session.commit()
+
+    return user.id
+
+# Runs every benchmark and returns a flat dict of name to latency statistics
+def run(sizes, repeat):
+    from app import create_app
+    from extensions import db, bcrypt
+    import models
+    import serializers
+    import utils
+
+    app = create_app()
+    app.app_context().push()
+    db.create_all()
+    client = app.test_client()
+    results = {}
+    plain_password = "BenchPassword1!"
+    password_hash = bcrypt.generate_password_hash(plain_password).decode("utf-8")
+
+    salt = os.urandom(16)
+    key = utils.derive_key("benchmark", salt)
+    results["utils.derive_key"] = measure(lambda: utils.derive_key("benchmark", salt), max(3, repeat // 10), 1)
+    results["utils.encrypt"] = measure(lambda: utils.encrypt("Password123!", key), repeat * 10)
+
+    for size in sizes:
+        # Fewer iterations for large vaults keep the suite runtime bounded
+        rounds = max(3, repeat // max(1, size // 1000))
+        user_id = seed_vault(db, models, utils, size, password_hash)
+        user = db.session.get(models.User, user_id)
+
+        folders, passwords = user.load_vault()
+        results[f"serialize_password[{size}]"] = measure(lambda: [serializers.serialize_password(password) for password in passwords], rounds)
+        results[f"serialize_folder[{size}]"] = measure(lambda: [serializers.serialize_folder(folder) for folder in folders], rounds)
+        db.session.expunge_all()
+
+        login = lambda: client.post("/api/login", json={"username": f"bench{size}", "password": plain_password})
+        results[f"login[{size}]"] = measure(login, max(3, repeat // 10), 1)
+        headers = {"Authorization": f"Bearer {login().get_json()['access_token']}"}
+
+        results[f"password_list[{size}]"] = measure(lambda: client.get("/api/password_list", headers=headers), rounds)
+        results[f"get_profile[{size}]"] = measure(lambda: client.get("/api/get_profile", headers=headers), rounds)
+
+        entry = {"account_name": "Bench", "username": "bench", "password": "Secret123!"}
+        results[f"passwords_post[{size}]"] = measure(lambda: client.post("/api/passwords", json=entry, headers=headers), repeat)
+
+        # Updates then deletes walk the entries the post benchmark just created, at least one each even for --repeat 1
+        created = [password_id for (password_id,) in db.session.query(models.Password.id).filter_by(user_id=user_id, account_name="Bench")]
+        half = max(1, repeat // 2)
+        patched = iter(created)
+        deleted = iter(created)
+        results[f"passwords_patch[{size}]"] = measure(lambda: client.patch("/api/passwords", json=dict(entry, id=next(patched)), headers=headers), half, 0)
+        results[f"passwords_delete[{size}]"] = measure(lambda: client.delete(f"/api/passwords?id={next(deleted)}", headers=headers), half, 0)
+        db.session.expunge_all()
+
+    return results
+
+# Returns the names whose median latency grew by more than the threshold
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["median_ms"]
+        after = stats["median_ms"]
+        if before and after > before * (1 + threshold):
+            regressions.append({"name": name, "baseline_ms": before, "current_ms": after, "change": round(after / before - 1, 3)})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend hot path benchmarks")
+    parser.add_argument("--sizes", default="10,1000,100000", help="comma separated vault sizes")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--database", help="SQLite file to use instead of a temporary one")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed median slowdown, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    # Timings should measure the request paths, not pool scheduling or throttling
+    os.environ.setdefault("HASH_POOL_WORKERS", "0")
+    os.environ.setdefault("LOGIN_RATE_LIMIT_ENABLED", "false")
+    configure(args.database)
+
+    results = run([int(size) for size in args.sizes.split(",")], args.repeat)
+    report = {"results": results}
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        report["regressions"] = compare(results, baseline, args.threshold)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    print(output)
+
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import BACKEND_DIR, configure
+
+# Runs in a fresh interpreter so module caches don't hide import cost
+PROBE = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.test_client().get("/")
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "create_app_ms": (created - imported) * 1000, "first_request_ms": (served - created) * 1000, "total_ms": (served - start) * 1000}))
+"""
+
+# Reports cold start cost with the optional extensions off and on
+def main():
+    parser = argparse.ArgumentParser(description="Import time and time to first request")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    configure()
+    variants = {
+        "default": {},
+        "admin_and_migrate": {"ADMIN_ENABLED": "true", "MIGRATE_ENABLED": "true"},
+    }
+    results = {}
+
+    for name, overrides in variants.items():
+        env = dict(os.environ, **overrides)
+        runs = [
+            json.loads(subprocess.run([sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True).stdout)
+            for _ in range(args.repeat)
+        ]
+        results[name] = {metric: round(statistics.median(run[metric] for run in runs), 2) for metric in runs[0]}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import json
+import random
+
+from common import configure, measure
+
+# Compares the old func.lower username scan with the indexed lookups at growing user counts
+def main():
+    parser = argparse.ArgumentParser(description="Authenticated user lookup latency")
+    parser.add_argument("--sizes", default="10000,1000000", help="comma separated user counts")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    configure()
+    from app import create_app
+    from extensions import db
+    from models import User
+    from sqlalchemy import insert
+    from sqlalchemy.sql import func
+    from flask_jwt_extended import create_access_token
+
+    app = create_app()
+    app.app_context().push()
+    db.create_all()
+    client = app.test_client()
+    results = []
+    seeded = 0
+
+    for size in sorted(int(size) for size in args.sizes.split(",")):
+        # Grows the user table in batches up to the next size
+        while seeded < size:
+            batch = min(10000, size - seeded)
+            db.session.execute(insert(User), [
+                {"username": f"User{n}", "username_lower": f"user{n}", "email": f"user{n}@example.com", "password": "x", "salt": "00" * 16}
+                for n in range(seeded, seeded + batch)
+            ])
+            db.session.commit()
+            seeded += batch
+
+        names = [f"USER{random.randrange(size)}" for _ in range(args.repeat)]
+        ids = [random.randrange(1, size + 1) for _ in range(args.repeat)]
+        with app.test_request_context():
+            token = create_access_token(identity=str(ids[0]), additional_claims={"uid": ids[0]})
+
+        lower_scan = iter(names * 2)
+        indexed_name = iter(names * 2)
+        by_id = iter(ids * 2)
+
+        results.append({
+            "users": size,
+            "func_lower_scan": measure(lambda: User.query.filter(func.lower(User.username) == func.lower(next(lower_scan))).first(), args.repeat, 0),
+            "username_lower_index": measure(lambda: User.query.filter_by(username_lower=next(indexed_name).lower()).first(), args.repeat, 0),
+            "primary_key": measure(lambda: db.session.get(User, next(by_id)), args.repeat, 0),
+            "check_token_request": measure(lambda: client.get("/api/check_token", headers={"Authorization": f"Bearer {token}"}), args.repeat),
+        })
+        db.session.expunge_all()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
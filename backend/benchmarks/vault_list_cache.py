@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import tempfile
+
+from common import configure, measure
+
+# Compares password_list requests that rebuild the response with ones served from the vault cache
+def main():
+    parser = argparse.ArgumentParser(description="password_list latency with and without the vault cache")
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--store", default="memory", help="memory, or sqlite to also time hits from the shared store")
+    args = parser.parse_args()
+
+    os.environ.setdefault("HASH_POOL_WORKERS", "0")
+    os.environ.setdefault("LOGIN_RATE_LIMIT_ENABLED", "false")
+    os.environ.setdefault("VAULT_CACHE_STORE", args.store)
+    os.environ.setdefault("VAULT_CACHE_SQLITE_PATH", os.path.join(tempfile.mkdtemp(prefix="vault-bench-"), "vault_cache.db"))
+    configure()
+    from app import create_app
+    from config import Config
+    from extensions import db, bcrypt
+    import models
+    import utils
+    from run import seed_vault
+    from serializers import COMPACT_MIMETYPE
+    import vault_cache
+
+    app = create_app()
+    app.app_context().push()
+    db.create_all()
+    client = app.test_client()
+    cache = vault_cache.vault_cache
+    password_hash = bcrypt.generate_password_hash("BenchPassword1!").decode("utf-8")
+    variants = {
+        "json": {},
+        "json_gzip": {"Accept-Encoding": "gzip"},
+        "compact_br": {"Accept": COMPACT_MIMETYPE, "Accept-Encoding": "br"},
+    }
+    results = []
+
+    for size in (int(size) for size in args.sizes.split(",")):
+        seed_vault(db, models, utils, size, password_hash)
+        db.session.expunge_all()
+        token = client.post("/api/login", json={"username": f"bench{size}", "password": "BenchPassword1!"}).get_json()["access_token"]
+
+        for name, headers in variants.items():
+            headers = dict(headers, Authorization=f"Bearer {token}")
+            fetch = lambda: client.get("/api/password_list", headers=headers)
+
+            Config.VAULT_CACHE_ENABLED = False
+            results.append(dict(measure(fetch, args.repeat, 1), entries=size, format=name, cache="off"))
+            Config.VAULT_CACHE_ENABLED = True
+            results.append(dict(measure(fetch, args.repeat, 1), entries=size, format=name, cache="memory_hit"))
+
+            # Empties the worker's memory store before every fetch so each one is answered by the shared store
+            if cache.shared is not None:
+                def shared_fetch():
+                    cache.memory = vault_cache.MemoryStore(Config.VAULT_CACHE_MAX_BYTES)
+                    return fetch()
+                results.append(dict(measure(shared_fetch, args.repeat, 1), entries=size, format=name, cache="shared_hit"))
+
+    print(json.dumps({"results": results, "stats": cache.stats()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import json
+import random
+
+from common import configure, measure
+
+# Compares the indexed search with a plain LIKE scan over a user's vault
+def main():
+    parser = argparse.ArgumentParser(description="Vault search latency")
+    parser.add_argument("--size", type=int, default=100000, help="passwords in the vault")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--small-size", type=int, default=10, help="passwords in a second user's vault, searched for a term every row shares")
+    args = parser.parse_args()
+
+    configure()
+    from app import create_app
+    from extensions import db
+    from sqlalchemy import or_
+    import models
+    import search
+    import utils
+    from run import seed_vault
+
+    app = create_app()
+    app.app_context().push()
+    db.create_all()
+    user_id = seed_vault(db, models, utils, args.size, "x")
+    small_user_id = seed_vault(db, models, utils, args.small_size, "x")
+    Password = models.Password
+
+    terms = [str(random.randrange(args.size)) for _ in range(args.repeat)]
+    naive_terms = iter(terms * 2)
+    indexed_terms = iter(terms * 2)
+
+    # What a search without the index would run, scanning every owned row
+    def naive():
+        pattern = f"%{next(naive_terms)}%"
+        return Password.owned_by(user_id) \
+            .filter(or_(Password.account_name.ilike(pattern), Password.username.ilike(pattern))) \
+            .order_by(Password.account_name) \
+            .limit(50) \
+            .all()
+
+    results = {
+        "passwords": args.size,
+        "like_scan": measure(naive, args.repeat),
+        "indexed_search": measure(lambda: search.search_passwords(user_id, next(indexed_terms), 50, 0), args.repeat),
+        # Every row of both vaults matches, so this only stays fast if other users' rows are never looked at
+        "small_vault_search": measure(lambda: search.search_passwords(small_user_id, "account", 50, 0), args.repeat),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
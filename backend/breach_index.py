@@ -0,0 +1,191 @@
+from config import Config
+from instrumentation import timed_function
+import argparse
+import gzip
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+
+# File layout: header, 65536 fan-out slots, then records sorted by hash
+#   header  MAGIC + record count (uint64)
+#   fan-out slot n holds the number of records whose first two hash bytes are <= n (uint32)
+#   record  the last 18 bytes of the SHA-1 followed by its breach count (uint32)
+MAGIC = b"VAULTBRX1\0"
+HEADER = struct.Struct("<10sQ")
+FANOUT = struct.Struct("<65536I")
+SUFFIX_SIZE = 18
+RECORD = struct.Struct(f"<{SUFFIX_SIZE}sI")
+DATA_OFFSET = HEADER.size + FANOUT.size
+MAX_COUNT = 2 ** 32 - 1
+
+# Writes records in large blocks so multi-GB inputs are streamed, not held in memory
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Builds an index file from "SHA1:COUNT" lines sorted by hash, returning the number of records
+def build(lines, output_path):
+    fanout = [0] * 65536
+    count = 0
+    previous = b""
+    buffer = bytearray()
+    temporary_path = output_path + ".tmp"
+
+    with open(temporary_path, "wb") as output:
+        output.write(b"\0" * DATA_OFFSET)
+
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+
+            digest, _, occurrences = line.partition(b":")
+            try:
+                digest = bytes.fromhex(digest.decode("ascii"))
+                occurrences = int(occurrences) if occurrences else 1
+            except ValueError:
+                raise ValueError(f"Line {line_number} is not a SHA-1 hash")
+            if len(digest) != 20:
+                raise ValueError(f"Line {line_number} is not a SHA-1 hash")
+
+            # Lookups binary search the records, so out of order input would make them miss
+            if digest <= previous:
+                raise ValueError(f"Line {line_number} is out of order or repeated, the input must be sorted by hash")
+            previous = digest
+
+            fanout[(digest[0] << 8) | digest[1]] += 1
+            buffer += RECORD.pack(digest[2:], min(occurrences, MAX_COUNT))
+            count += 1
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                output.write(buffer)
+                buffer.clear()
+
+        output.write(buffer)
+        if count > MAX_COUNT:
+            raise ValueError("Too many hashes for one index")
+
+        # Turns per prefix counts into running totals so slot n is where prefix n ends
+        total = 0
+        for prefix in range(65536):
+            total += fanout[prefix]
+            fanout[prefix] = total
+
+        output.seek(0)
+        output.write(HEADER.pack(MAGIC, count))
+        output.write(FANOUT.pack(*fanout))
+
+    # Swaps the new file in whole so readers never see a half written index
+    os.replace(temporary_path, output_path)
+    return count
+
+# Read only view of an index file, paged in by the OS instead of loaded into memory
+class BreachIndex:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or len(self._map) != DATA_OFFSET + self.count * RECORD.size:
+            self._map.close()
+            raise ValueError(f"{path} is not a breach index")
+
+    # First and last record positions for a two byte prefix
+    def _bucket(self, prefix):
+        start = struct.unpack_from("<I", self._map, HEADER.size + (prefix - 1) * 4)[0] if prefix else 0
+        end = struct.unpack_from("<I", self._map, HEADER.size + prefix * 4)[0]
+        return start, end
+
+    # Position of the first record in [low, high) whose suffix is not below the given one
+    def _lower_bound(self, suffix, low, high):
+        data = self._map
+        while low < high:
+            middle = (low + high) // 2
+            offset = DATA_OFFSET + middle * RECORD.size
+            if data[offset:offset + SUFFIX_SIZE] < suffix:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Times a SHA-1 digest appears in the breach corpus, 0 when it does not
+    def lookup(self, digest):
+        start, end = self._bucket((digest[0] << 8) | digest[1])
+        position = self._lower_bound(digest[2:], start, end)
+        if position < end:
+            suffix, occurrences = RECORD.unpack_from(self._map, DATA_OFFSET + position * RECORD.size)
+            if suffix == digest[2:]:
+                return occurrences
+        return 0
+
+    # Every hash starting with a five hex character prefix, so clients can check without sending their hash
+    def range(self, prefix):
+        digest_prefix = bytes.fromhex(prefix[:4])
+        nibble = int(prefix[4], 16)
+        start, end = self._bucket((digest_prefix[0] << 8) | digest_prefix[1])
+        low = self._lower_bound(bytes([nibble << 4]), start, end)
+        high = self._lower_bound(bytes([(nibble + 1) << 4]), low, end) if nibble < 15 else end
+
+        matches = {}
+        for position in range(low, high):
+            suffix, occurrences = RECORD.unpack_from(self._map, DATA_OFFSET + position * RECORD.size)
+            matches[(digest_prefix + suffix).hex().upper()[5:]] = occurrences
+        return matches
+
+    def close(self):
+        self._map.close()
+
+_index = None
+_lock = threading.Lock()
+
+# The configured index, opened on first use, or None when there isn't one
+def get_index():
+    global _index
+    if _index is None and Config.BREACH_INDEX_PATH and os.path.exists(Config.BREACH_INDEX_PATH):
+        with _lock:
+            if _index is None:
+                _index = BreachIndex(Config.BREACH_INDEX_PATH)
+    return _index
+
+# Times a plaintext password appears in the breach corpus, None when no index is configured
+@timed_function("breach")
+def breach_count(password):
+    index = get_index()
+    if index is None:
+        return None
+    return index.lookup(hashlib.sha1(password.encode("utf-8")).digest())
+
+# Warning shown to users saving a breached password, None when it is not known to be breached
+def breach_warning(password):
+    count = breach_count(password)
+    if not count:
+        return None
+    return f"This password has appeared {count:,} times in known data breaches, consider changing it"
+
+def _open_input(path):
+    if path == "-":
+        return sys.stdin.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb", buffering=WRITE_BUFFER_SIZE)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline breached password index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_command = commands.add_parser("build", help="build an index from a hash sorted SHA1:COUNT dump")
+    build_command.add_argument("input", help="dump file, .gz files are decompressed and - reads stdin")
+    build_command.add_argument("output", nargs="?", default=Config.BREACH_INDEX_PATH or "breach.idx")
+    check_command = commands.add_parser("check", help="look up a password")
+    check_command.add_argument("password")
+    check_command.add_argument("--index", default=Config.BREACH_INDEX_PATH or "breach.idx")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with _open_input(args.input) as lines:
+            print(f"Indexed {build(lines, args.output)} hashes into {args.output}")
+    else:
+        index = BreachIndex(args.index)
+        print(index.lookup(hashlib.sha1(args.password.encode("utf-8")).digest()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from config import Config
+from flask import request
+import gzip
+
+# brotli is optional, gzip is used without it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Best encoding the client accepts, or None
+def choose_encoding(accept_encodings):
+    if brotli and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+def compress_as(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=Config.COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=Config.COMPRESS_GZIP_LEVEL)
+
+# Compresses a body with the best encoding the client accepts, or returns None
+def compress(body, accept_encodings):
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return None
+    return encoding, compress_as(body, encoding)
+
+# Compresses buffered responses above the size threshold
+def init_app(app):
+    @app.after_request
+    def compress_response(response):
+        if (not Config.COMPRESS_ENABLED
+                or response.direct_passthrough
+                or response.status_code < 200 or response.status_code >= 300
+                or "Content-Encoding" in response.headers
+                or (response.content_length or 0) < Config.COMPRESS_MIN_SIZE):
+            return response
+
+        compressed = compress(response.get_data(), request.accept_encodings)
+        if compressed is None:
+            return response
+
+        encoding, body = compressed
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
@@ -2,11 +2,132 @@ import os
 from datetime import timedelta
 
 
+# Engine pool settings, sizes are left to SQLAlchemy's defaults unless set
+def engine_options():
+    options = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    }
+    if os.getenv("DB_POOL_SIZE"):
+        options["pool_size"] = int(os.getenv("DB_POOL_SIZE"))
+    if os.getenv("DB_MAX_OVERFLOW"):
+        options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW"))
+    if os.getenv("DB_POOL_TIMEOUT"):
+        options["pool_timeout"] = int(os.getenv("DB_POOL_TIMEOUT"))
+    return options
+
+# Read replicas become binds named replica_0, replica_1, ...
+def replica_binds():
+    urls = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    return {f"replica_{index}": url for index, url in enumerate(urls)}
+
+# Shards for user data become binds named shard_0, shard_1, ...
+def shard_binds():
+    urls = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+    return {f"shard_{index}": url for index, url in enumerate(urls)}
 
 # Configerations for the app
 class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options()
+    SQLALCHEMY_BINDS = {**replica_binds(), **shard_binds()}
     SQLALCHEMY_TRACK_MODIFICATIONS = True
     SECRET_KEY = os.getenv("SECRET_KEY")
     JWT_SECRET_KEY = os.getenv("JWT_KEY")
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=2)
\ No newline at end of file
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=2)
+
+    # Derived vault key cache
+    KEY_CACHE_ENABLED = os.getenv("KEY_CACHE_ENABLED", "true").lower() == "true"
+    KEY_CACHE_SIZE = int(os.getenv("KEY_CACHE_SIZE", 1024))
+    KEY_CACHE_TTL = int(os.getenv("KEY_CACHE_TTL", 900))
+
+    # Paginated password listing
+    PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", 50))
+    PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", 200))
+
+    # Bulk import and export
+    IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 500))
+    EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+    # Batch mutations
+    BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", 500))
+
+    # Process pool for bcrypt and key derivation, 0 workers runs them inline. Every server worker gets its own pool,
+    # so by default the host's cores are split between the WEB_CONCURRENCY server workers rather than given to each.
+    WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+    HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", max(1, (os.cpu_count() or 1) // max(1, WEB_CONCURRENCY))))
+    HASH_POOL_QUEUE = int(os.getenv("HASH_POOL_QUEUE", 64))
+    HASH_POOL_TIMEOUT = float(os.getenv("HASH_POOL_TIMEOUT", 10))
+    HASH_POOL_START_METHOD = os.getenv("HASH_POOL_START_METHOD", "forkserver")
+
+    # Request timing, Server-Timing headers and /metrics
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # Bearer token scrapers send for /metrics and /api/pool_stats, both answer 404 while it is unset
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+    # Sliding window login throttle, the store is "memory" or "sqlite" to share it between workers
+    LOGIN_RATE_LIMIT_ENABLED = os.getenv("LOGIN_RATE_LIMIT_ENABLED", "true").lower() == "true"
+    LOGIN_RATE_LIMIT_IP = int(os.getenv("LOGIN_RATE_LIMIT_IP", 30))
+    LOGIN_RATE_LIMIT_USER = int(os.getenv("LOGIN_RATE_LIMIT_USER", 10))
+    LOGIN_RATE_WINDOW = int(os.getenv("LOGIN_RATE_WINDOW", 60))
+    RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+    RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "ratelimit.db")
+    RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+    # Reverse proxies in front of the app whose X-Forwarded-For entries are trusted for the client address. Leave at 0
+    # when clients connect directly, or every client behind a proxy shares the proxy's address and its login limit.
+    TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", 0))
+
+    # Stores new passwords as versioned AES-GCM envelopes instead of AES-CBC, clients must understand "v2:" values first
+    VAULT_GCM = os.getenv("VAULT_GCM", "false").lower() == "true"
+
+    # Rows re-encrypted per committed chunk during key rotation
+    REENCRYPT_CHUNK_SIZE = int(os.getenv("REENCRYPT_CHUNK_SIZE", 500))
+
+    # Response compression for bodies of at least COMPRESS_MIN_SIZE bytes
+    COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() == "true"
+    COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+    COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 5))
+
+    # Seconds a client's reads stay on the primary after it writes, carried in a cookie so every worker honours it
+    REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+
+    # Optional extensions, only imported when enabled
+    MIGRATE_ENABLED = os.getenv("MIGRATE_ENABLED", "false").lower() == "true"
+    ADMIN_ENABLED = os.getenv("ADMIN_ENABLED", "false").lower() == "true"
+    # Basic auth credentials for the admin pages, the admin is not mounted without a password
+    ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
+    ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "")
+
+    # Deepest a folder can be nested, root folders are at depth 0
+    FOLDER_MAX_DEPTH = int(os.getenv("FOLDER_MAX_DEPTH", 10))
+
+    # Index built by breach_index.py that saved passwords are checked against, checks are skipped when unset
+    BREACH_INDEX_PATH = os.getenv("BREACH_INDEX_PATH", "")
+
+    # Vault audit, entries scoring below AUDIT_WEAK_SCORE (0-4) are weak and unchanged for AUDIT_MAX_AGE_DAYS are old
+    AUDIT_WEAK_SCORE = int(os.getenv("AUDIT_WEAK_SCORE", 2))
+    AUDIT_MAX_AGE_DAYS = int(os.getenv("AUDIT_MAX_AGE_DAYS", 365))
+
+    # Where logouts are recorded, "database", "sqlite" for one host or "memory" for a single worker,
+    # each worker picks up other workers' revocations at most REVOCATION_REFRESH_SECONDS late
+    REVOCATION_STORE = os.getenv("REVOCATION_STORE", "database")
+    REVOCATION_SQLITE_PATH = os.getenv("REVOCATION_SQLITE_PATH", "revocation.db")
+    REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", 1))
+
+    # Ids each shard hands out start at (shard + 1) * SHARD_ID_SPACING so rows keep their ids when users move,
+    # the id columns are BIGINT so the default leaves room for millions of shards
+    SHARD_ID_SPACING = int(os.getenv("SHARD_ID_SPACING", 2 ** 40))
+
+    # Encrypted attachment files, ATTACHMENT_PATH must be shared by every host serving the app
+    ATTACHMENT_PATH = os.getenv("ATTACHMENT_PATH", "attachments")
+    ATTACHMENT_MAX_SIZE = int(os.getenv("ATTACHMENT_MAX_SIZE", 100 * 1024 * 1024))
+    ATTACHMENT_QUOTA = int(os.getenv("ATTACHMENT_QUOTA", 1024 * 1024 * 1024))
+    ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", 64 * 1024))
+
+    # Encoded /api/password_list bodies cached per user and vault version, in each worker and optionally in a
+    # SQLite file ("sqlite" store) shared by the workers on a host, each holding at most VAULT_CACHE_MAX_BYTES
+    VAULT_CACHE_ENABLED = os.getenv("VAULT_CACHE_ENABLED", "true").lower() == "true"
+    VAULT_CACHE_MAX_BYTES = int(os.getenv("VAULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    VAULT_CACHE_STORE = os.getenv("VAULT_CACHE_STORE", "memory")
+    VAULT_CACHE_SQLITE_PATH = os.getenv("VAULT_CACHE_SQLITE_PATH", "vault_cache.db")
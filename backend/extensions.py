@@ -0,0 +1,9 @@
+from flask_sqlalchemy import SQLAlchemy
+from flask_bcrypt import Bcrypt
+from flask_jwt_extended import JWTManager
+from routing import RoutingSession
+
+# Extensions are created unbound and attached to an app in create_app
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+bcrypt = Bcrypt()
+jwt = JWTManager()
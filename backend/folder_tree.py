@@ -0,0 +1,138 @@
+from sqlalchemy import event
+from sqlalchemy.orm import aliased, selectinload
+from sqlalchemy.sql import func
+from extensions import db
+from models import Folder, FolderClosure, Password, Tombstone
+from serializers import serialize_folder
+from config import Config
+import attachments
+import sharding
+
+# Adds a new folder's closure rows, copied from its parent's ancestors plus itself, in one statement
+@event.listens_for(Folder, "after_insert")
+def _add_closure(mapper, connection, folder):
+    ancestors = db.select(FolderClosure.ancestor_id, db.literal(folder.id), FolderClosure.depth + 1) \
+        .where(FolderClosure.descendant_id == folder.parent_id)
+    own = db.select(db.literal(folder.id), db.literal(folder.id), db.literal(0))
+    rows = db.union_all(ancestors, own) if folder.parent_id else own
+    connection.execute(db.insert(FolderClosure).from_select(["ancestor_id", "descendant_id", "depth"], rows))
+
+def _subtree_ids(folder_id):
+    return db.select(FolderClosure.descendant_id).where(FolderClosure.ancestor_id == folder_id)
+
+# How deep a folder is nested, 0 for a root folder
+def depth(folder_id):
+    return db.session.execute(
+        db.select(func.coalesce(func.max(FolderClosure.depth), 0)).where(FolderClosure.descendant_id == folder_id)
+    ).scalar()
+
+# Nested folders with their accounts and recursive account counts, all of a user's folders when folder_id is None
+def subtree(user_id, folder_id=None):
+    scope = db.select(Folder.id).where(Folder.user_id == user_id)
+    if folder_id is not None:
+        scope = scope.where(Folder.id.in_(_subtree_ids(folder_id)))
+
+    folders = Folder.query.filter(Folder.id.in_(scope)).options(selectinload(Folder.passwords)).order_by(Folder.id).all()
+
+    # Counts the passwords under every folder in the scope, its descendants included, in one grouped query
+    counts = dict(db.session.execute(
+        db.select(FolderClosure.ancestor_id, func.count(Password.id))
+        .join(Password, Password.folder_id == FolderClosure.descendant_id)
+        .where(FolderClosure.ancestor_id.in_(scope))
+        .group_by(FolderClosure.ancestor_id)
+    ).all())
+
+    nodes = {}
+    for folder in folders:
+        nodes[folder.id] = dict(serialize_folder(folder), account_count=counts.get(folder.id, 0), folders=[])
+
+    roots = []
+    for folder in folders:
+        parent = nodes.get(folder.parent_id)
+        if parent is not None:
+            parent["folders"].append(nodes[folder.id])
+        else:
+            roots.append(nodes[folder.id])
+    return roots
+
+# Counts the passwords in a folder and every folder below it
+def count_entries(folder_id):
+    return db.session.execute(
+        db.select(func.count(Password.id)).where(Password.folder_id.in_(_subtree_ids(folder_id)))
+    ).scalar()
+
+# Moves a folder and everything below it under a new parent, or to the top level when parent is None
+def move_subtree(folder, parent):
+    parent_id = parent.id if parent is not None else None
+    if parent_id == folder.parent_id:
+        return
+
+    if parent is not None:
+        # Checks for a cycle and the resulting depth in one round trip
+        inside, height, parent_depth = db.session.execute(db.select(
+            db.exists().where(FolderClosure.ancestor_id == folder.id, FolderClosure.descendant_id == parent.id),
+            db.select(func.max(FolderClosure.depth)).where(FolderClosure.ancestor_id == folder.id).scalar_subquery(),
+            db.select(func.max(FolderClosure.depth)).where(FolderClosure.descendant_id == parent.id).scalar_subquery()
+        )).one()
+        if inside:
+            raise ValueError("A folder cannot be moved inside itself")
+        if (parent_depth or 0) + 1 + (height or 0) > Config.FOLDER_MAX_DEPTH:
+            raise ValueError(f"Folders cannot be nested more than {Config.FOLDER_MAX_DEPTH} levels deep")
+
+    # Detaches the subtree from its old ancestors
+    subtree_ids = _subtree_ids(folder.id)
+    db.session.execute(
+        db.delete(FolderClosure)
+        .where(FolderClosure.descendant_id.in_(subtree_ids), FolderClosure.ancestor_id.not_in(subtree_ids)),
+        execution_options={"synchronize_session": False}
+    )
+
+    # Links every new ancestor to every folder in the subtree
+    if parent is not None:
+        above = aliased(FolderClosure)
+        below = aliased(FolderClosure)
+        db.session.execute(db.insert(FolderClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            db.select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .select_from(above)
+            .join(below, db.true())
+            .where(above.descendant_id == parent.id, below.ancestor_id == folder.id)
+        ))
+
+    folder.parent_id = parent_id
+
+# Deletes a folder, every folder below it and all of their passwords, leaving tombstones for sync
+def delete_subtree(user, folder, version):
+    # Includes the folder itself in case it predates the closure table
+    folder_ids = list(dict.fromkeys([folder.id, *db.session.execute(_subtree_ids(folder.id)).scalars()]))
+    password_ids = db.session.execute(db.select(Password.id).where(Password.folder_id.in_(folder_ids))).scalars().all()
+
+    db.session.execute(db.insert(Tombstone), [
+        {"user_id": user.id, "kind": kind, "item_id": item_id, "version": version}
+        for kind, ids in (("folder", folder_ids), ("password", password_ids))
+        for item_id in ids
+    ])
+    attachments.delete_for_passwords(password_ids)
+    db.session.execute(db.delete(Password).where(Password.folder_id.in_(folder_ids)))
+    db.session.execute(db.delete(FolderClosure).where(FolderClosure.descendant_id.in_(folder_ids)))
+    db.session.execute(db.delete(Folder).where(Folder.id.in_(folder_ids)))
+    return folder_ids, password_ids
+
+# Rebuilds the closure table from parent ids, for databases created before nesting
+def rebuild_closure():
+    tree = db.select(Folder.id.label("ancestor_id"), Folder.id.label("descendant_id"), db.literal(0).label("depth")) \
+        .cte("tree", recursive=True)
+    tree = tree.union_all(
+        db.select(tree.c.ancestor_id, Folder.id, tree.c.depth + 1).join(Folder, Folder.parent_id == tree.c.descendant_id)
+    )
+    for shard in sharding.each_shard():
+        with sharding.use_shard(shard):
+            db.session.execute(db.delete(FolderClosure))
+            db.session.execute(db.insert(FolderClosure).from_select(["ancestor_id", "descendant_id", "depth"], db.select(tree)))
+            db.session.commit()
+
+if __name__ == "__main__":
+    from app import create_app
+    with create_app().app_context():
+        rebuild_closure()
+        print("Folder closure rebuilt")
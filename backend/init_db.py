@@ -1,11 +1,14 @@
-from app import db
+from app import create_app
+from extensions import db, bcrypt
 from models import User
-from app import bcrypt
+import sharding
 
 # Creates intial user
-db.create_all()
-if not User.query.first():
-    hashed_password = bcrypt.generate_password_hash("Password123").decode('utf-8')
-    admin = User(username="user1", email="Fake@aol.com", password=hashed_password)
-    db.session.add(admin)
-    db.session.commit()
\ No newline at end of file
+with create_app().app_context():
+    db.create_all()
+    sharding.create_all()
+    if not sharding.username_taken("user1"):
+        hashed_password = bcrypt.generate_password_hash("Password123").decode('utf-8')
+        admin = User(username="user1", email="Fake@aol.com", password=hashed_password)
+        db.session.add(admin)
+        db.session.commit()
@@ -0,0 +1,155 @@
+from contextlib import contextmanager
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import Config
+import functools
+import hmac
+import threading
+import time
+
+# Upper bounds in seconds of the request latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {}
+_query_totals = {"count": 0, "seconds": 0.0}
+_collectors = []
+
+# Adds elapsed seconds under a name to the current request's timing breakdown
+def record(name, seconds):
+    if has_request_context():
+        timings = g.setdefault("timings", {})
+        timings[name] = timings.get(name, 0.0) + seconds
+
+# Times a block of code as part of the current request
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+# Times every call of a function as part of the current request
+def timed_function(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not has_request_context():
+                return fn(*args, **kwargs)
+            with timed(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Registers a callable returning extra metric lines for /metrics
+def add_collector(collector):
+    _collectors.append(collector)
+
+# Start times are kept per statement, so a statement's time is never paired with another statement's start
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", {})[context] = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop(context)
+    with _lock:
+        _query_totals["count"] += 1
+        _query_totals["seconds"] += elapsed
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+        record("db", elapsed)
+
+# A failed statement never reaches after_cursor_execute, so its start time is dropped here instead of being paired
+# with a later statement or kept on the pooled connection forever
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    if context.connection is not None:
+        context.connection.info.get("query_start", {}).pop(context.execution_context, None)
+
+def _observe(endpoint, method, seconds):
+    with _lock:
+        histogram = _histograms.get((endpoint, method))
+        if histogram is None:
+            histogram = _histograms[(endpoint, method)] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][index] += 1
+                break
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+# Turns a dict of numeric stats into gauge lines for a collector
+def gauge_lines(prefix, stats):
+    return [f"{prefix}_{name} {value}" for name, value in stats.items() if isinstance(value, (int, float))]
+
+# Renders every metric in the Prometheus text format
+def render_metrics():
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by endpoint",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    with _lock:
+        for (endpoint, method), histogram in sorted(_histograms.items()):
+            labels = f'endpoint="{endpoint}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {histogram["sum"]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {histogram["count"]}')
+
+        lines.append("# TYPE db_queries_total counter")
+        lines.append(f'db_queries_total {_query_totals["count"]}')
+        lines.append("# TYPE db_query_seconds_total counter")
+        lines.append(f'db_query_seconds_total {_query_totals["seconds"]:.6f}')
+
+    for collector in _collectors:
+        lines.extend(collector())
+
+    return "\n".join(lines) + "\n"
+
+# Serves a view only to requests bearing METRICS_TOKEN, and to no one while it is unset
+def metrics_access(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        expected = f"Bearer {Config.METRICS_TOKEN}"
+        if not Config.METRICS_TOKEN or not hmac.compare_digest(request.headers.get("Authorization", "").encode(), expected.encode()):
+            abort(404)
+        return fn(*args, **kwargs)
+    return wrapper
+
+# Hooks request timing, Server-Timing headers and the /metrics endpoint into the app
+def init_app(app):
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.timings = {}
+        g.query_count = 0
+
+    @app.after_request
+    def finish_timer(response):
+        start = g.pop("request_start", None)
+        if start is None:
+            return response
+
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        _observe(endpoint, request.method, elapsed)
+
+        # Breaks the request time down for browser dev tools and tracing proxies
+        timings = g.get("timings", {})
+        parts = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.items()]
+        if "db" in timings:
+            parts[list(timings).index("db")] += f';desc="{g.get("query_count", 0)} queries"'
+        parts.append(f'total;dur={elapsed * 1000:.2f}')
+        response.headers["Server-Timing"] = ", ".join(parts)
+        return response
+
+    @app.route("/metrics")
+    @metrics_access
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from config import Config
+import hashlib
+import threading
+import time
+import workers
+
+# Bounded LRU cache of derived vault keys so repeat writes skip the KDF
+class KeyCache:
+    def __init__(self, max_size=1024, ttl=900):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Fingerprint changes whenever the stored hash or salt changes
+    @staticmethod
+    def fingerprint(password_hash, salt):
+        return hashlib.sha256(f"{password_hash}:{salt}".encode()).hexdigest()
+
+    # Returns the cached key for a user or derives and stores it
+    def get(self, user):
+        cache_key = (user.id, self.fingerprint(user.password, user.salt))
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry and entry[1] > now:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                del self._entries[cache_key]
+            self.misses += 1
+
+        # Derives outside the lock so other users are not blocked by the KDF
+        key = workers.derive_key(user.password, bytes.fromhex(user.salt))
+
+        with self._lock:
+            self._entries[cache_key] = (key, now + self.ttl)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return key
+
+    # Drops every cached key for a user, used when their credentials change
+    def invalidate(self, user_id):
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[cache_key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+key_cache = KeyCache(max_size=Config.KEY_CACHE_SIZE, ttl=Config.KEY_CACHE_TTL)
+
+# Gets the vault encryption key for a user
+def get_user_key(user):
+    if not Config.KEY_CACHE_ENABLED:
+        return workers.derive_key(user.password, bytes.fromhex(user.salt))
+    return key_cache.get(user)
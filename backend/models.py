@@ -1,14 +1,24 @@
-from app import db
+from extensions import db
 from flask_login import UserMixin
 from sqlalchemy import CheckConstraint
+from sqlalchemy.orm import selectinload, validates
 from sqlalchemy.sql import func
 from datetime import datetime
 import os
 
+# Ids and foreign keys of user data. Shards hand out ids from ranges far above 32 bits, so they are BIGINT, except on
+# SQLite whose INTEGER is already 64-bit and is the only type an AUTOINCREMENT primary key may have.
+BigId = db.BigInteger().with_variant(db.Integer(), "sqlite")
+
+# Table options for rows that live on a user's shard. Ids are never reused, so deleted ids stay unique in
+# tombstones and each shard can be seeded with its own id range.
+SHARDED = {"info": {"sharded": True}, "sqlite_autoincrement": True}
+
 # User accounts
 class User(db.Model, UserMixin):
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(BigId, primary_key=True)
     username = db.Column(db.String(30), unique=True, nullable=False)
+    username_lower = db.Column(db.String(30), unique=True, index=True, nullable=False)
     email = db.Column(db.String(80), nullable=False)
     password = db.Column(db.String(120), nullable=False)
     folders = db.relationship("Folder", backref='user',cascade="all, delete-orphan", lazy="select", foreign_keys='Folder.user_id')
@@ -16,18 +26,75 @@ class User(db.Model, UserMixin):
     failed_attempts = db.Column(db.Integer, default=0)
     locked_until =  db.Column(db.DateTime, server_default=db.func.now())
     created_at = db.Column(db.DateTime, server_default=func.now())
-    salt = db.Column(db.String(40), default=os.urandom(16).hex())
+    salt = db.Column(db.String(40), default=lambda: os.urandom(16).hex())
+    vault_version = db.Column(db.Integer, default=0, nullable=False)
+    # Generation of the key material, raised every time the vault key changes
+    key_version = db.Column(db.Integer, default=0, nullable=False)
+    tombstones = db.relationship("Tombstone", backref='user', cascade="all, delete-orphan", lazy="select")
+
+    __table_args__ = SHARDED
+
+    # Keeps the indexed lowercase username in step with the username
+    @validates('username')
+    def validate_username(self, key, username):
+        self.username_lower = username.lower()
+        return username
+
+    # Increments the vault version in SQL so concurrent writers serialize on the user row
+    def bump_version(self):
+        self.vault_version = User.vault_version + 1
+        db.session.flush()
+        return self.vault_version
+
+    # Records that a folder or password was deleted so clients can sync it away
+    def add_tombstone(self, kind, item_id, version):
+        db.session.add(Tombstone(user_id=self.id, kind=kind, item_id=item_id, version=version))
+
+    # Counts folders, accounts and accounts per folder in a single grouped query
+    def vault_stats(self):
+        per_folder = db.select(Folder.id, func.count(Password.id)) \
+            .select_from(Folder) \
+            .outerjoin(Password, Password.folder_id == Folder.id) \
+            .where(Folder.user_id == self.id) \
+            .group_by(Folder.id)
+        unfiled = db.select(db.cast(db.null(), db.Integer), func.count(Password.id)) \
+            .where(Password.user_id == self.id)
+        # Compound selects reach the session without their tables, so the mapper is passed for shard routing
+        rows = db.session.execute(db.union_all(per_folder, unfiled), bind_arguments={"mapper": Folder}).all()
+
+        folder_counts = {folder_id: count for folder_id, count in rows if folder_id is not None}
+        return {
+            "folder_count": len(folder_counts),
+            "account_count": sum(count for _, count in rows),
+            "folder_counts": folder_counts
+        }
+
+    # Tag identifying the current state of the vault
+    @property
+    def etag(self):
+        return f"{self.id}-{self.vault_version}"
+
+    # Loads all folders, their passwords and unfiled passwords in a fixed number of queries
+    def load_vault(self):
+        folders = Folder.query.filter_by(user_id=self.id).options(selectinload(Folder.passwords)).order_by(Folder.id).all()
+        passwords = Password.query.filter_by(user_id=self.id).order_by(Password.id).all()
+        return folders, passwords
 
     def __repr__(self):
         return self.username
 
 # Account folders
 class Folder(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(BigId, primary_key=True)
     name = db.Column(db.String(50), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+    user_id = db.Column(BigId, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
+    parent_id = db.Column(BigId, db.ForeignKey('folder.id', ondelete="CASCADE"), nullable=True, index=True)
     passwords = db.relationship("Password", backref="folder", cascade="all, delete-orphan",lazy="select", foreign_keys='Password.folder_id')
     created_at = db.Column(db.DateTime, server_default=func.now())
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+    version = db.Column(db.Integer, default=0, nullable=False, index=True)
+
+    __table_args__ = SHARDED
 
     def count_passwords(self):
         return Password.query.filter_by(folder_id=self.id).count()
@@ -35,21 +102,128 @@ class Folder(db.Model):
     def __repr__(self):
         return f"{self.name}| Folder_id - {self.id}"
 
+# Every ancestor and descendant pair of the folder tree, including each folder with itself at depth 0
+class FolderClosure(db.Model):
+    ancestor_id = db.Column(BigId, db.ForeignKey('folder.id', ondelete="CASCADE"), primary_key=True)
+    descendant_id = db.Column(BigId, db.ForeignKey('folder.id', ondelete="CASCADE"), primary_key=True, index=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = {"info": {"sharded": True}}
+
+    def __repr__(self):
+        return f"FolderClosure - {self.ancestor_id} > {self.descendant_id}"
+
 # Accounts
 class Password(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(BigId, primary_key=True)
     account_name = db.Column(db.String(100), nullable=False)
     username = db.Column(db.String(100), nullable=False)
     password = db.Column(db.String(250), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=True)
-    folder_id = db.Column(db.Integer, db.ForeignKey('folder.id', ondelete="CASCADE"), nullable=True)
+    user_id = db.Column(BigId, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=True)
+    folder_id = db.Column(BigId, db.ForeignKey('folder.id', ondelete="CASCADE"), nullable=True)
     created_at = db.Column(db.DateTime, server_default=func.now())
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+    version = db.Column(db.Integer, default=0, nullable=False, index=True)
+    # The owner's key_version when this password was encrypted
+    key_version = db.Column(db.Integer, default=0, nullable=False)
 
     __table_args__ = (
         CheckConstraint('NOT(user_id IS NULL AND folder_id IS NULL)', name='user_or_folder_not_null'),
-        CheckConstraint('NOT(user_id IS NOT NULL AND folder_id IS NOT NULL)', name='user_or_folder_not_both')
+        CheckConstraint('NOT(user_id IS NOT NULL AND folder_id IS NOT NULL)', name='user_or_folder_not_both'),
+        # Keep unfiled and foldered passwords in id order so pages are read straight off the index
+        db.Index('ix_password_user_id_id', 'user_id', 'id'),
+        db.Index('ix_password_folder_id_id', 'folder_id', 'id'),
+        SHARDED
     )
 
+    # Query of every password a user owns, unfiled or inside one of their folders
+    @classmethod
+    def owned_by(cls, user_id):
+        folder_ids = db.select(Folder.id).where(Folder.user_id == user_id)
+        return cls.query.filter(db.or_(cls.user_id == user_id, cls.folder_id.in_(folder_ids)))
+
     def __repr__(self):
         return f"Password_ID - {self.id}"
-    
+
+# Encrypted files stored alongside an account, the contents live in the attachment blob store
+class Attachment(db.Model):
+    id = db.Column(BigId, primary_key=True)
+    user_id = db.Column(BigId, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
+    password_id = db.Column(BigId, db.ForeignKey('password.id', ondelete="CASCADE"), nullable=False, index=True)
+    name = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    blob = db.Column(db.String(32), unique=True, nullable=False)
+    # The file's own key, encrypted with the user's vault key so key rotation never rewrites the file
+    key = db.Column(db.String(200), nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=func.now())
+
+    __table_args__ = SHARDED
+
+    def __repr__(self):
+        return f"Attachment - {self.name} on {self.password_id}"
+
+# Deleted folders and passwords kept for delta sync
+class Tombstone(db.Model):
+    id = db.Column(BigId, primary_key=True)
+    user_id = db.Column(BigId, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+    kind = db.Column(db.String(10), nullable=False)
+    item_id = db.Column(BigId, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, server_default=func.now())
+
+    __table_args__ = (
+        db.Index('ix_tombstone_user_version', 'user_id', 'version'),
+        SHARDED
+    )
+
+    def __repr__(self):
+        return f"Tombstone - {self.kind} {self.item_id}"
+
+# Resumable re-encryption of a user's passwords after their key material changed
+class ReencryptionJob(db.Model):
+    id = db.Column(BigId, primary_key=True)
+    user_id = db.Column(BigId, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False, index=True)
+    old_password = db.Column(db.String(120), nullable=True)
+    old_salt = db.Column(db.String(40), nullable=True)
+    start_version = db.Column(db.Integer, nullable=False)
+    key_version = db.Column(db.Integer, default=0, nullable=False)
+    last_id = db.Column(BigId, default=0, nullable=False)
+    processed = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Integer, default=0, nullable=False)
+    status = db.Column(db.String(10), default="pending", nullable=False)
+    error = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, server_default=func.now())
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = SHARDED
+
+    def __repr__(self):
+        return f"ReencryptionJob - user {self.user_id} {self.status}"
+
+# Revoked access tokens, either one token by jti or every token a user was issued before not_before
+class RevokedToken(db.Model):
+    seq = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), nullable=True)
+    user_id = db.Column(BigId, nullable=True)
+    not_before = db.Column(db.Float, nullable=True)
+    expires = db.Column(db.Float, nullable=False, index=True)
+
+    # Workers read new rows by seq, so SQLite must never reuse the seq of a pruned row
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    def __repr__(self):
+        return f"RevokedToken - {self.jti or self.user_id}"
+
+# Which shard holds each user, kept on the main database. Its ids are the user ids on every shard.
+class ShardDirectory(db.Model):
+    id = db.Column(BigId, primary_key=True)
+    username_lower = db.Column(db.String(30), unique=True, nullable=False)
+    shard = db.Column(db.Integer, nullable=False, index=True)
+    moving = db.Column(db.Boolean, default=False, nullable=False)
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    def __repr__(self):
+        return f"ShardDirectory - {self.username_lower} on {self.shard}"
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from config import Config
+import os
+import sqlite3
+import threading
+import time
+
+# Per worker counters kept in a bounded LRU so a flood of keys can't grow memory
+class MemoryStore:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Counts a hit in the given window and returns the (previous, current) window counts
+    def incr(self, key, window):
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None or entry[0] < window - 1:
+                entry = [window, 0, 0]
+            elif entry[0] == window - 1:
+                entry = [window, 0, entry[1]]
+            entry[1] += 1
+
+            self._counters[key] = entry
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+
+            return entry[2], entry[1]
+
+# Counters in a SQLite file so every worker on a host shares the same limits
+class SqliteStore:
+    def __init__(self, path, prune_every=1000):
+        self.path = path
+        self.prune_every = prune_every
+        self._hits = 0
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit (key TEXT, window INTEGER, count INTEGER, PRIMARY KEY (key, window))"
+        )
+
+    # One connection per thread and process, a connection inherited from before a fork is never reused
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def incr(self, key, window):
+        connection = self._connect()
+        current = connection.execute(
+            "INSERT INTO rate_limit (key, window, count) VALUES (?, ?, 1) "
+            "ON CONFLICT (key, window) DO UPDATE SET count = count + 1 RETURNING count",
+            (key, window)
+        ).fetchone()[0]
+        previous = connection.execute(
+            "SELECT count FROM rate_limit WHERE key = ? AND window = ?", (key, window - 1)
+        ).fetchone()
+
+        # Drops windows that can no longer affect a limit
+        self._hits += 1
+        if self._hits % self.prune_every == 0:
+            connection.execute("DELETE FROM rate_limit WHERE window < ?", (window - 1,))
+
+        return (previous[0] if previous else 0), current
+
+# Sliding window limiter that weights the previous fixed window by how much of it still overlaps
+class SlidingWindowLimiter:
+    def __init__(self, store, limit, window):
+        self.store = store
+        self.limit = limit
+        self.window = window
+
+    # Counts a hit for key and returns whether it is within the limit
+    def hit(self, key):
+        now = time.time()
+        window = int(now // self.window)
+        previous, current = self.store.incr(key, window)
+        overlap = 1 - (now % self.window) / self.window
+        return previous * overlap + current <= self.limit
+
+
+def create_store():
+    if Config.RATE_LIMIT_STORE == "sqlite":
+        return SqliteStore(Config.RATE_LIMIT_SQLITE_PATH)
+    return MemoryStore(Config.RATE_LIMIT_MAX_KEYS)
+
+_store = create_store()
+ip_limiter = SlidingWindowLimiter(_store, Config.LOGIN_RATE_LIMIT_IP, Config.LOGIN_RATE_WINDOW)
+username_limiter = SlidingWindowLimiter(_store, Config.LOGIN_RATE_LIMIT_USER, Config.LOGIN_RATE_WINDOW)
+
+# Checks a login attempt against the per IP and per username limits
+def allow_login(ip, username):
+    ip_allowed = ip_limiter.hit(f"login-ip:{ip}")
+    username_allowed = username_limiter.hit(f"login-user:{username.lower()}")
+    return ip_allowed and username_allowed
@@ -0,0 +1,181 @@
+from app import create_app
+from extensions import db
+from models import User, Password, Attachment, ReencryptionJob
+from keycache import get_user_key, key_cache
+from config import Config
+import argparse
+import multiprocessing
+import os
+import sharding
+import utils
+
+# Records a job to move a user's passwords from their old key material to the current one
+def start_job(user, old_password, old_salt):
+    # Rows still on an older key would be decrypted with the wrong one if rotations overlapped
+    if ReencryptionJob.query.filter(ReencryptionJob.user_id == user.id, ReencryptionJob.status != "done").first():
+        raise ValueError(f"{user.username} already has an unfinished re-encryption job")
+
+    # Rows are tagged with the key generation they were encrypted under, so the job finds every row still on an
+    # older key however else the row changed while it ran
+    user.key_version += 1
+    job = ReencryptionJob(
+        user_id=user.id,
+        old_password=old_password,
+        old_salt=old_salt,
+        start_version=user.vault_version,
+        key_version=user.key_version,
+        total=Password.owned_by(user.id).filter(Password.key_version < user.key_version).count()
+    )
+    db.session.add(job)
+    key_cache.invalidate(user.id)
+    return job
+
+# Gives a user a fresh salt and queues re-encryption of their passwords under the new key
+def rotate_salt(user):
+    job = start_job(user, user.password, user.salt)
+    user.salt = os.urandom(16).hex()
+    db.session.commit()
+    return job
+
+# Id of the first row in a chunk that does not decrypt with the key
+def _unreadable_id(rows, key):
+    for row in rows:
+        try:
+            utils.decrypt(row.password, key)
+        except ValueError:
+            return row.id
+    return None
+
+# Re-encrypts a job's passwords in chunks ordered by id, committing a checkpoint after each chunk
+def run_job(job_id, chunk_size=Config.REENCRYPT_CHUNK_SIZE, progress=print):
+    job = db.session.get(ReencryptionJob, job_id)
+    if job is None or job.status == "done":
+        return job_id, "done"
+
+    user = db.session.get(User, job.user_id)
+    old_key = utils.derive_key(job.old_password, bytes.fromhex(job.old_salt))
+    new_key = get_user_key(user)
+    job.status = "running"
+    db.session.commit()
+
+    while True:
+        # Rows written after the job started already use the new key
+        rows = Password.owned_by(user.id) \
+            .filter(Password.id > job.last_id, Password.key_version < job.key_version) \
+            .order_by(Password.id) \
+            .limit(chunk_size) \
+            .all()
+        if not rows:
+            break
+
+        try:
+            plaintexts = utils.decrypt_many([row.password for row in rows], old_key)
+        except ValueError as error:
+            row_id = _unreadable_id(rows, old_key)
+            db.session.rollback()
+            job.status = "failed"
+            job.error = f"Could not decrypt password {row_id}: {error}"[:200]
+            db.session.commit()
+            progress(f"job {job.id}: {job.error}")
+            return job_id, "failed"
+
+        version = user.bump_version()
+        for row, ciphertext in zip(rows, utils.encrypt_many(plaintexts, new_key, Config.VAULT_GCM)):
+            row.password = ciphertext
+            row.key_version = job.key_version
+            row.version = version
+
+        job.last_id = rows[-1].id
+        job.processed += len(rows)
+        db.session.commit()
+        progress(f"job {job.id}: user {user.id} {job.processed}/{job.total}")
+
+    # Attachment files keep their own keys, so only those keys are re-encrypted, never the files
+    attachments = Attachment.query.filter(Attachment.user_id == user.id, Attachment.version <= job.start_version).all()
+    if attachments:
+        try:
+            file_keys = utils.decrypt_many([attachment.key for attachment in attachments], old_key)
+        except ValueError as error:
+            db.session.rollback()
+            job.status = "failed"
+            job.error = f"Could not decrypt an attachment key: {error}"[:200]
+            db.session.commit()
+            progress(f"job {job.id}: {job.error}")
+            return job_id, "failed"
+
+        version = user.bump_version()
+        for attachment, key in zip(attachments, utils.encrypt_many(file_keys, new_key, gcm=True)):
+            attachment.key = key
+            attachment.version = version
+        db.session.commit()
+
+    # The old key material is no longer needed once every row has moved
+    job.status = "done"
+    job.old_password = None
+    job.old_salt = None
+    db.session.commit()
+    return job_id, "done"
+
+def _run_job_on_shard(target):
+    shard, job_id = target
+    with sharding.use_shard(shard):
+        return run_job(job_id)
+
+# Builds one app per pool process, so connections are never shared with the parent and jobs reuse them
+def _init_process():
+    global _process_context
+    _process_context = create_app().app_context()
+    _process_context.push()
+
+# Runs every unfinished job on every shard, one process per user when workers is above one
+def resume(workers=1):
+    targets = []
+    for shard in sharding.each_shard():
+        with sharding.use_shard(shard):
+            targets += [(shard, job.id) for job in ReencryptionJob.query.filter(ReencryptionJob.status != "done").order_by(ReencryptionJob.id)]
+    if workers <= 1 or len(targets) <= 1:
+        return [_run_job_on_shard(target) for target in targets]
+
+    db.session.remove()
+    with multiprocessing.get_context("fork").Pool(workers, initializer=_init_process) as pool:
+        return pool.map(_run_job_on_shard, targets)
+
+# Runs one CLI command inside an app context
+def run_command(args):
+    if args.command == "rotate-salt":
+        for shard in sharding.each_shard():
+            with sharding.use_shard(shard):
+                users = User.query.filter_by(username_lower=args.user.lower()).all() if args.user else User.query.order_by(User.id).all()
+                for user in users:
+                    try:
+                        rotate_salt(user)
+                    except ValueError as error:
+                        db.session.rollback()
+                        print(error)
+        db.session.remove()
+        print(resume(args.workers))
+    elif args.command == "resume":
+        db.session.remove()
+        print(resume(args.workers))
+    else:
+        for shard in sharding.each_shard():
+            with sharding.use_shard(shard):
+                for job in ReencryptionJob.query.filter(ReencryptionJob.status != "done").order_by(ReencryptionJob.id):
+                    print(f"job {job.id}: user {job.user_id} {job.status} {job.processed}/{job.total} {job.error or ''}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encrypt vault passwords after key material changes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rotate = commands.add_parser("rotate-salt", help="give users a new salt and re-encrypt their vault")
+    rotate.add_argument("--user", help="username, all users when omitted")
+    rotate.add_argument("--workers", type=int, default=1)
+    run = commands.add_parser("resume", help="finish every unfinished job")
+    run.add_argument("--workers", type=int, default=1)
+    commands.add_parser("status", help="list unfinished jobs")
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        run_command(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+from config import Config
+from extensions import db
+from models import RevokedToken
+import os
+import sqlite3
+import threading
+import time
+
+# Every store keeps revocations in insertion order under an increasing seq so workers can fetch only what is new.
+# A row either revokes one token by jti, or every token of user_id issued before not_before.
+
+# Token claim holding the exact time a token was issued, iat is rounded down to the second
+ISSUED_CLAIM = "issued"
+
+# Claims added to every new token
+def token_claims(identity):
+    return {ISSUED_CLAIM: time.time()}
+
+# Rows re-read behind the newest seq seen, since a concurrent insert can commit after a higher seq is already visible
+SEQ_OVERLAP = 100
+
+# Revocations held in this process only, for a single worker or tests
+class MemoryStore:
+    def __init__(self):
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def add(self, jti, user_id, not_before, expires):
+        with self._lock:
+            seq = self._rows[-1][0] + 1 if self._rows else 1
+            self._rows.append((seq, jti, user_id, not_before, expires))
+
+    # Revocations added after seq, oldest first
+    def since(self, seq):
+        with self._lock:
+            return [row for row in self._rows if row[0] > seq]
+
+    def prune(self, now):
+        with self._lock:
+            self._rows = [row for row in self._rows if row[4] >= now]
+
+# Revocations in a SQLite file shared by every worker on a host
+class SqliteStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS revoked_token "
+            "(seq INTEGER PRIMARY KEY AUTOINCREMENT, jti TEXT, user_id INTEGER, not_before REAL, expires REAL NOT NULL)"
+        )
+
+    # One connection per thread and process, a connection inherited from before a fork is never reused
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def add(self, jti, user_id, not_before, expires):
+        self._connect().execute(
+            "INSERT INTO revoked_token (jti, user_id, not_before, expires) VALUES (?, ?, ?, ?)",
+            (jti, user_id, not_before, expires)
+        )
+
+    def since(self, seq):
+        return self._connect().execute(
+            "SELECT seq, jti, user_id, not_before, expires FROM revoked_token WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+
+    def prune(self, now):
+        self._connect().execute("DELETE FROM revoked_token WHERE expires < ?", (now,))
+
+# Revocations in the app database so every worker on every host sees them
+class DatabaseStore:
+    # Always uses the primary, a lagging replica could miss a fresh logout
+    def add(self, jti, user_id, not_before, expires):
+        with db.engine.begin() as connection:
+            connection.execute(db.insert(RevokedToken).values(jti=jti, user_id=user_id, not_before=not_before, expires=expires))
+
+    def since(self, seq):
+        with db.engine.connect() as connection:
+            return connection.execute(
+                db.select(RevokedToken.seq, RevokedToken.jti, RevokedToken.user_id, RevokedToken.not_before, RevokedToken.expires)
+                .where(RevokedToken.seq > seq)
+                .order_by(RevokedToken.seq)
+            ).all()
+
+    def prune(self, now):
+        with db.engine.begin() as connection:
+            connection.execute(db.delete(RevokedToken).where(RevokedToken.expires < now))
+
+# Per worker copy of the unexpired revocations, topped up from the store at most once per refresh interval,
+# so checking a token is a dict lookup instead of a store query
+class RevocationCache:
+    def __init__(self, store, refresh_seconds=1.0, prune_every=3600):
+        self.store = store
+        self.refresh_seconds = refresh_seconds
+        self.prune_every = prune_every
+        self._jtis = {}
+        self._not_before = {}
+        self._seq = 0
+        self._next_refresh = 0.0
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+
+    def _apply(self, rows):
+        for seq, jti, user_id, not_before, expires in rows:
+            if jti:
+                self._jtis[jti] = expires
+            else:
+                self._not_before[user_id] = (max(not_before, self._not_before.get(user_id, (0, 0))[0]), expires)
+            self._seq = max(self._seq, seq)
+
+    # Fetches revocations made by other workers since the last refresh and forgets expired ones
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+
+        with self._lock:
+            if not force and now < self._next_refresh:
+                return
+            self._apply(self.store.since(self._seq - SEQ_OVERLAP))
+            self._next_refresh = now + self.refresh_seconds
+
+            wall = time.time()
+            self._jtis = {jti: expires for jti, expires in self._jtis.items() if expires >= wall}
+            self._not_before = {user_id: entry for user_id, entry in self._not_before.items() if entry[1] >= wall}
+            if now >= self._next_prune:
+                self.store.prune(wall)
+                self._next_prune = now + self.prune_every
+
+    # Whether a decoded token has been revoked
+    def is_revoked(self, payload):
+        self.refresh()
+        if payload.get("jti") in self._jtis:
+            return True
+        not_before = self._not_before.get(payload.get("uid"))
+        return not_before is not None and payload.get(ISSUED_CLAIM, payload.get("iat", 0)) < not_before[0]
+
+    # Revokes one token until it would have expired anyway
+    def revoke(self, payload):
+        self.store.add(payload["jti"], payload.get("uid"), None, payload["exp"])
+        with self._lock:
+            self._jtis[payload["jti"]] = payload["exp"]
+
+    # Revokes every token issued to a user so far. Tokens are compared by their exact issue time, so one issued right
+    # after this survives, while an older token with only a whole second iat is caught for the current second too.
+    def revoke_user(self, user_id):
+        not_before = time.time()
+        expires = not_before + Config.JWT_ACCESS_TOKEN_EXPIRES.total_seconds()
+        self.store.add(None, user_id, not_before, expires)
+        with self._lock:
+            self._not_before[user_id] = (not_before, expires)
+
+    def stats(self):
+        return {"revoked_tokens": len(self._jtis), "revoked_users": len(self._not_before), "seq": self._seq}
+
+
+def create_store():
+    if Config.REVOCATION_STORE == "sqlite":
+        return SqliteStore(Config.REVOCATION_SQLITE_PATH)
+    if Config.REVOCATION_STORE == "memory":
+        return MemoryStore()
+    return DatabaseStore()
+
+revocations = RevocationCache(create_store(), Config.REVOCATION_REFRESH_SECONDS)
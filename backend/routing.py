@@ -0,0 +1,91 @@
+from flask import g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect
+from sqlalchemy.sql.util import find_tables
+from config import Config
+import functools
+import math
+import random
+import time
+
+REPLICA_PREFIX = "replica_"
+SHARD_PREFIX = "shard_"
+
+# Raised when user data is queried with sharding on but no shard chosen for the request
+class NoShardSelected(RuntimeError):
+    pass
+
+# Name of the cookie holding the time until which a client's reads stay on the primary
+STICKY_COOKIE = "replica_sticky_until"
+
+# Keeps the client's reads on the primary for a short window after it writes. The deadline travels with the client
+# in a cookie, so it holds whichever worker or host serves the next request.
+def mark_write():
+    g.sticky_until = time.time() + Config.REPLICA_STICKY_SECONDS
+
+# Deadlines further out than a fresh window are ignored, so a client can't pin itself to the primary
+def is_sticky():
+    now = time.time()
+    if g.get("sticky_until", 0) > now:
+        return True
+    try:
+        until = float(request.cookies.get(STICKY_COOKIE, 0))
+    except ValueError:
+        return False
+    return now < until <= now + Config.REPLICA_STICKY_SECONDS
+
+def _is_sharded(mapper, clause):
+    if mapper is not None:
+        return inspect(mapper).local_table.info.get("sharded", False)
+    if clause is not None:
+        return any(table.info.get("sharded", False) for table in find_tables(clause, include_crud=True))
+    return False
+
+# Session that sends user data to the request's shard, reads from read only endpoints to a replica
+# and everything else to the primary
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and SHARD_PREFIX + "0" in self._db.engines and _is_sharded(mapper, clause):
+            shard = g.get("shard") if has_app_context() else None
+            if shard is None:
+                raise NoShardSelected("User data was queried before a shard was selected")
+            return self._db.engines[SHARD_PREFIX + str(shard)]
+
+        if bind is None and not self._flushing and has_request_context() and g.get("read_only"):
+            replicas = [engine for key, engine in self._db.engines.items() if key and key.startswith(REPLICA_PREFIX)]
+            if replicas and not is_sticky():
+                return random.choice(replicas)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+# Marks a resource method as safe to serve from a read replica
+def read_only(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            g.read_only = False
+    return wrapper
+
+# Starts the client's stickiness window whenever a request commits a write
+@event.listens_for(RoutingSession, "after_flush")
+def _after_flush(session, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "after_commit")
+def _after_commit(session):
+    if session.info.pop("wrote", False) and has_request_context():
+        mark_write()
+
+# Hands the stickiness window to the client on responses to requests that wrote
+def init_app(app):
+    @app.after_request
+    def set_sticky_cookie(response):
+        until = g.get("sticky_until")
+        if until is not None:
+            response.set_cookie(
+                STICKY_COOKIE, f"{until:.3f}", max_age=math.ceil(Config.REPLICA_STICKY_SECONDS),
+                httponly=True, secure=request.is_secure, samesite="Lax"
+            )
+        return response
@@ -0,0 +1,127 @@
+from sqlalchemy import event, text
+from extensions import db
+from models import Password, Folder
+import sharding
+
+# Trigram indexes only help once a query has at least one full trigram
+MIN_INDEXED_LENGTH = 3
+
+# Each row is indexed with its owner as "<user_id>", so a search matches the owner's phrase first and never ranks
+# other users' rows. The index keeps its own copy of the text, so rows can be removed by rowid alone, even when the
+# folder that gave a row its owner has already been deleted.
+SQLITE_OWNER = "'<' || COALESCE(new.user_id, (SELECT user_id FROM folder WHERE id = new.folder_id)) || '>'"
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS password_fts USING fts5(owner, account_name, username, tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS password_fts_insert AFTER INSERT ON password BEGIN "
+    f"INSERT INTO password_fts (rowid, owner, account_name, username) VALUES (new.id, {SQLITE_OWNER}, new.account_name, new.username); END",
+    "CREATE TRIGGER IF NOT EXISTS password_fts_delete AFTER DELETE ON password BEGIN "
+    "DELETE FROM password_fts WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS password_fts_update AFTER UPDATE OF account_name, username, user_id, folder_id ON password BEGIN "
+    "DELETE FROM password_fts WHERE rowid = old.id; "
+    f"INSERT INTO password_fts (rowid, owner, account_name, username) VALUES (new.id, {SQLITE_OWNER}, new.account_name, new.username); END",
+]
+
+# Index objects from before rows carried their owner, dropped when the index is rebuilt
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS password_fts_insert",
+    "DROP TRIGGER IF EXISTS password_fts_delete",
+    "DROP TRIGGER IF EXISTS password_fts_update",
+    "DROP TABLE IF EXISTS password_fts",
+]
+
+SQLITE_FILL = (
+    "INSERT INTO password_fts (rowid, owner, account_name, username) "
+    "SELECT password.id, '<' || COALESCE(password.user_id, folder.user_id) || '>', password.account_name, password.username "
+    "FROM password LEFT JOIN folder ON folder.id = password.folder_id"
+)
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_password_account_name_trgm ON password USING gin (lower(account_name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_password_username_trgm ON password USING gin (lower(username) gin_trgm_ops)",
+]
+
+# Creates the search index for the connection's database
+def create_index(connection):
+    statements = {"sqlite": SQLITE_DDL, "postgresql": POSTGRES_DDL}.get(connection.dialect.name, [])
+    for statement in statements:
+        connection.execute(text(statement))
+
+# Builds the index along with the password table
+@event.listens_for(Password.__table__, "after_create")
+def _create_index(table, connection, **kwargs):
+    create_index(connection)
+
+# Drops the index along with the password table, so ids of a recreated table never meet old index rows
+@event.listens_for(Password.__table__, "after_drop")
+def _drop_index(table, connection, **kwargs):
+    if connection.dialect.name == "sqlite":
+        for statement in SQLITE_DROP:
+            connection.execute(text(statement))
+
+# Creates the index on existing databases and fills it from the password table
+def rebuild_index():
+    for engine in sharding.data_engines():
+        with engine.begin() as connection:
+            if connection.dialect.name == "sqlite":
+                for statement in SQLITE_DROP:
+                    connection.execute(text(statement))
+            create_index(connection)
+            if connection.dialect.name == "sqlite":
+                connection.execute(text(SQLITE_FILL))
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# Matches rows whose account name or username fits a LIKE pattern, case insensitively
+def _matches(pattern):
+    return db.or_(
+        db.func.lower(Password.account_name).like(pattern, escape="\\"),
+        db.func.lower(Password.username).like(pattern, escape="\\")
+    )
+
+# Ranked search over a user's account names and usernames, prefix matches first
+def search_passwords(user_id, query, limit, offset):
+    query = query.strip().lower()
+    prefix = _escape_like(query) + "%"
+    substring = "%" + prefix
+    is_prefix = db.case((_matches(prefix), 0), else_=1)
+    statement = db.select(Password).where(
+        db.or_(Password.user_id == user_id, Password.folder_id.in_(db.select(Folder.id).where(Folder.user_id == user_id)))
+    )
+    dialect = db.session.get_bind(Password).dialect.name
+
+    if len(query) < MIN_INDEXED_LENGTH:
+        # Too short for trigrams, so only prefix matches inside the user's own rows
+        statement = statement.where(_matches(prefix)).order_by(Password.account_name, Password.id)
+    elif dialect == "sqlite":
+        # FTS5 trigram phrase match within the user's own rows. bm25 is left out, its statistics count matches across
+        # every user's rows, so rows are ranked by where the term matched and how short the account name is instead.
+        match = f'owner : "<{int(user_id)}>" AND {{account_name username}} : "' + query.replace('"', '""') + '"'
+        fts = text("SELECT rowid FROM password_fts WHERE password_fts MATCH :match") \
+            .bindparams(match=match) \
+            .columns(db.column("rowid", db.Integer)) \
+            .subquery("fts")
+        in_account_name = db.case((db.func.lower(Password.account_name).like(substring, escape="\\"), 0), else_=1)
+        statement = statement.join(fts, fts.c.rowid == Password.id) \
+            .order_by(is_prefix, in_account_name, db.func.length(Password.account_name), Password.id)
+    elif dialect == "postgresql":
+        # LIKE on the lowered columns is served by the trigram GIN indexes
+        similarity = db.func.greatest(
+            db.func.similarity(db.func.lower(Password.account_name), query),
+            db.func.similarity(db.func.lower(Password.username), query)
+        )
+        statement = statement.where(_matches(substring)).order_by(is_prefix, similarity.desc(), Password.id)
+    else:
+        statement = statement.where(_matches(substring)).order_by(is_prefix, Password.account_name, Password.id)
+
+    # Fetches one extra row to know if there is another page
+    rows = db.session.execute(statement.limit(limit + 1).offset(offset)).scalars().all()
+    return rows[:limit], len(rows) > limit
+
+if __name__ == "__main__":
+    from app import create_app
+    with create_app().app_context():
+        rebuild_index()
+        print("Search index rebuilt")
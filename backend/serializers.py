@@ -1,6 +1,22 @@
 from datetime import datetime
+import calendar
+import json
 import utils
 
+# orjson is optional, the standard library encoder is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPACT_MIMETYPE = "application/vnd.vault.compact+json"
+
+# Column order of the compact rows
+COMPACT_FIELDS = {
+    "password": ["id", "name", "username", "password", "created"],
+    "folder": ["id", "name", "created", "accounts", "parent_id"]
+}
+
 # Serializer for passwords
 def serialize_password(password):
     return {
@@ -16,6 +32,41 @@ def serialize_folder(folder):
     return {
         "id": folder.id,
         "name": folder.name,
+        "parent_id": folder.parent_id,
         "created": folder.created_at.strftime('%Y-%m-%d %H:%M:%S'),
         "accounts": [serialize_password(password) for password in folder.passwords]
     }
+
+# Serializer for a folder without its accounts
+def serialize_folder_meta(folder):
+    return {
+        "id": folder.id,
+        "name": folder.name,
+        "parent_id": folder.parent_id,
+        "created": folder.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+# Serializer for attachment details, the contents are downloaded separately
+def serialize_attachment(attachment):
+    return {
+        "id": attachment.id,
+        "password_id": attachment.password_id,
+        "name": attachment.name,
+        "content_type": attachment.content_type,
+        "size": attachment.size,
+        "created": attachment.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+# Compact serializer for passwords, a row in COMPACT_FIELDS order with an epoch timestamp
+def serialize_password_row(password):
+    return [password.id, password.account_name, password.username, password.password, calendar.timegm(password.created_at.timetuple())]
+
+# Compact serializer for folders with their accounts as compact rows
+def serialize_folder_row(folder):
+    return [folder.id, folder.name, calendar.timegm(folder.created_at.timetuple()), [serialize_password_row(password) for password in folder.passwords], folder.parent_id]
+
+# Encodes compact payloads with the fastest encoder available
+def dumps_compact(data):
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
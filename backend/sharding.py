@@ -0,0 +1,270 @@
+from flask import g
+from sqlalchemy import event, inspect, text
+from extensions import db
+from routing import RoutingSession, SHARD_PREFIX
+from models import User, Folder, FolderClosure, Password, Attachment, Tombstone, ReencryptionJob, ShardDirectory
+from revocation import revocations
+from config import Config
+import argparse
+import contextlib
+import hashlib
+import time
+
+# Extra wait after revoking a moving user's tokens so requests already past the check can finish
+MOVE_GRACE_SECONDS = 2
+
+# Raised when a user is looked up while their rows are being copied to another shard
+class ShardMoving(Exception):
+    pass
+
+def shard_count():
+    return sum(1 for key in db.engines if key and key.startswith(SHARD_PREFIX))
+
+def enabled():
+    return shard_count() > 0
+
+def shard_engine(shard):
+    return db.engines[SHARD_PREFIX + str(shard)]
+
+# Stable placement of a user id, the same in every process and across restarts
+def shard_for(user_id, count=None):
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % (count or shard_count())
+
+# Routes user data queries to a shard for the rest of the block
+@contextlib.contextmanager
+def use_shard(shard):
+    previous = g.get("shard")
+    g.shard = shard
+    try:
+        yield
+    finally:
+        g.shard = previous
+
+# Every shard number, or just None when sharding is off, for tools that visit all user data
+def each_shard():
+    return list(range(shard_count())) or [None]
+
+# The engines holding user data
+def data_engines():
+    return [shard_engine(shard) for shard in range(shard_count())] or [db.engine]
+
+# Directory entry for a username or user id, read from the main database
+def lookup(username=None, user_id=None):
+    statement = db.select(ShardDirectory.id, ShardDirectory.shard, ShardDirectory.moving)
+    if username is not None:
+        statement = statement.where(ShardDirectory.username_lower == username.lower())
+    else:
+        statement = statement.where(ShardDirectory.id == user_id)
+    with db.engine.connect() as connection:
+        return connection.execute(statement).first()
+
+# Finds a user by username and selects their shard for the rest of the request
+def find_user(username):
+    if not enabled():
+        return User.query.filter_by(username_lower=username.lower()).first()
+
+    entry = lookup(username=username)
+    if entry is None:
+        return None
+    if entry.moving:
+        raise ShardMoving(username)
+    g.shard = entry.shard
+    return db.session.get(User, entry.id)
+
+# Whether a username is in use on any shard, without changing the request's shard
+def username_taken(username):
+    if not enabled():
+        return User.query.filter_by(username_lower=username.lower()).first() is not None
+    return lookup(username=username) is not None
+
+# Claims to issue a user's tokens with, including their shard so requests skip the directory
+def token_claims(user):
+    claims = {"uid": user.id}
+    if enabled():
+        claims["shard"] = g.shard
+    return claims
+
+# Selects the shard a token's requests go to, asking the directory for tokens issued before sharding
+def select_for_token(jwt_data):
+    if not enabled():
+        return
+    shard = jwt_data.get("shard")
+    if shard is None and jwt_data.get("uid") is not None:
+        entry = lookup(user_id=jwt_data["uid"])
+        shard = entry.shard if entry else None
+    g.shard = shard
+
+# Gives new users a directory entry, whose id decides their shard, and keeps renames in the directory
+@event.listens_for(RoutingSession, "before_flush")
+def _sync_directory(session, flush_context, instances):
+    if not any(isinstance(obj, User) for obj in session.new) and not any(isinstance(obj, User) for obj in session.dirty):
+        return
+    if not enabled():
+        return
+
+    for user in [obj for obj in session.new if isinstance(obj, User) and obj.id is None]:
+        with db.engine.begin() as connection:
+            user_id = connection.execute(
+                db.insert(ShardDirectory).values(username_lower=user.username_lower, shard=-1)
+            ).inserted_primary_key[0]
+            shard = shard_for(user_id)
+            connection.execute(db.update(ShardDirectory).where(ShardDirectory.id == user_id).values(shard=shard))
+        user.id = user_id
+        g.shard = shard
+
+    for user in [obj for obj in session.dirty if isinstance(obj, User)]:
+        history = inspect(user).attrs.username_lower.history
+        if history.deleted and history.added:
+            with db.engine.begin() as connection:
+                connection.execute(
+                    db.update(ShardDirectory).where(ShardDirectory.id == user.id).values(username_lower=user.username_lower)
+                )
+
+def _sharded_tables():
+    return [table for table in db.metadata.sorted_tables if table.info.get("sharded")]
+
+# Creates the user data tables on every shard and starts each shard's ids in its own range
+def create_all():
+    # Ids are 64-bit, the last shard's range has to end below the largest of them
+    if (shard_count() + 1) * Config.SHARD_ID_SPACING > 2 ** 63 - 1:
+        raise ValueError(f"SHARD_ID_SPACING of {Config.SHARD_ID_SPACING} is too large for {shard_count()} shards")
+    for shard in range(shard_count()):
+        engine = shard_engine(shard)
+        db.metadata.create_all(engine, tables=_sharded_tables())
+
+        start = (shard + 1) * Config.SHARD_ID_SPACING
+        with engine.begin() as connection:
+            for table in _sharded_tables():
+                if "id" not in table.c or table.name == User.__tablename__:
+                    continue
+                if engine.dialect.name == "sqlite":
+                    connection.execute(
+                        text("INSERT INTO sqlite_sequence (name, seq) SELECT :name, :start "
+                             "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"),
+                        {"name": table.name, "start": start}
+                    )
+                elif engine.dialect.name == "postgresql":
+                    connection.execute(
+                        text(f"SELECT setval(pg_get_serial_sequence(:name, 'id'), GREATEST(:start, (SELECT COALESCE(MAX(id), 0) FROM {table.name})))"),
+                        {"name": table.name, "start": start}
+                    )
+
+# Every table's rows that belong to a user, parents first
+def _user_rows(user_id):
+    folder_ids = db.select(Folder.__table__.c.id).where(Folder.__table__.c.user_id == user_id)
+    return [
+        (User.__table__, User.__table__.c.id == user_id),
+        (Folder.__table__, Folder.__table__.c.user_id == user_id),
+        (FolderClosure.__table__, FolderClosure.__table__.c.descendant_id.in_(folder_ids)),
+        (Password.__table__, db.or_(Password.__table__.c.user_id == user_id, Password.__table__.c.folder_id.in_(folder_ids))),
+        (Attachment.__table__, Attachment.__table__.c.user_id == user_id),
+        (Tombstone.__table__, Tombstone.__table__.c.user_id == user_id),
+        (ReencryptionJob.__table__, ReencryptionJob.__table__.c.user_id == user_id),
+    ]
+
+# Copies a user's rows with their ids in one transaction on the target
+def _copy_user(user_id, source, target, chunk_size=1000):
+    with source.connect() as reader, target.begin() as writer:
+        for table, where in _user_rows(user_id):
+            result = reader.execution_options(yield_per=chunk_size).execute(db.select(table).where(where))
+            for rows in result.mappings().partitions():
+                writer.execute(db.insert(table), [dict(row) for row in rows])
+
+def _delete_user(user_id, engine):
+    with engine.begin() as connection:
+        for table, where in reversed(_user_rows(user_id)):
+            connection.execute(db.delete(table).where(where))
+
+def _set_directory(user_ids, **values):
+    with db.engine.begin() as connection:
+        connection.execute(db.update(ShardDirectory).where(ShardDirectory.id.in_(user_ids)).values(**values))
+
+# Moves users to new shards given (user_id, shard) pairs, logging them out first so nothing writes mid copy
+def move_users(moves, progress=print):
+    moves = [(user_id, shard) for user_id, shard in moves if lookup(user_id=user_id).shard != shard]
+    if not moves:
+        return 0
+
+    user_ids = [user_id for user_id, _ in moves]
+    _set_directory(user_ids, moving=True)
+    for user_id in user_ids:
+        revocations.revoke_user(user_id)
+    time.sleep(Config.REVOCATION_REFRESH_SECONDS + MOVE_GRACE_SECONDS)
+
+    for user_id, shard in moves:
+        source = lookup(user_id=user_id).shard
+        try:
+            _copy_user(user_id, shard_engine(source), shard_engine(shard))
+        except Exception:
+            _set_directory([user_id], moving=False)
+            raise
+        _set_directory([user_id], shard=shard, moving=False)
+        _delete_user(user_id, shard_engine(source))
+        progress(f"user {user_id}: shard {source} -> {shard}")
+
+    return len(moves)
+
+# Moves every user whose shard no longer matches their hash, after shards were added or removed
+def rebalance(progress=print):
+    with db.engine.connect() as connection:
+        entries = connection.execute(db.select(ShardDirectory.id, ShardDirectory.shard)).all()
+    return move_users([(user_id, shard_for(user_id)) for user_id, shard in entries if shard != shard_for(user_id)], progress)
+
+# Moves users from the main database into shards when sharding is turned on for an existing install
+def import_users(progress=print):
+    with db.engine.connect() as connection:
+        users = connection.execute(db.select(User.__table__.c.id, User.__table__.c.username_lower)).all()
+
+    for user_id, username_lower in users:
+        shard = shard_for(user_id)
+        with db.engine.begin() as connection:
+            connection.execute(db.insert(ShardDirectory).values(id=user_id, username_lower=username_lower, shard=shard, moving=True))
+        _copy_user(user_id, db.engine, shard_engine(shard))
+        _set_directory([user_id], moving=False)
+        _delete_user(user_id, db.engine)
+        progress(f"user {user_id}: main -> {shard}")
+
+    return len(users)
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage user data shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="create tables on every shard")
+    move = commands.add_parser("move", help="move one user to a shard")
+    move.add_argument("username")
+    move.add_argument("shard", type=int)
+    commands.add_parser("rebalance", help="move users whose shard no longer matches their hash")
+    commands.add_parser("import", help="move users from the main database into shards")
+    commands.add_parser("status", help="count users per shard")
+    args = parser.parse_args()
+
+    from app import create_app
+    with create_app().app_context():
+        if not enabled():
+            parser.error("DATABASE_SHARD_URLS is not set")
+
+        if args.command == "create":
+            db.create_all()
+            create_all()
+        elif args.command == "move":
+            entry = lookup(username=args.username)
+            if entry is None:
+                parser.error(f"{args.username} not found")
+            if not 0 <= args.shard < shard_count():
+                parser.error(f"shard must be between 0 and {shard_count() - 1}")
+            move_users([(entry.id, args.shard)])
+        elif args.command == "rebalance":
+            print(f"Moved {rebalance()} users")
+        elif args.command == "import":
+            print(f"Imported {import_users()} users")
+        else:
+            with db.engine.connect() as connection:
+                counts = dict(connection.execute(
+                    db.select(ShardDirectory.shard, db.func.count()).group_by(ShardDirectory.shard)
+                ).all())
+            for shard in range(shard_count()):
+                print(f"shard {shard}: {counts.get(shard, 0)} users")
+
+if __name__ == "__main__":
+    main()
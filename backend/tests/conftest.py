@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Config reads the environment at import, so the test settings go in before the app is imported
+DATABASE_DIR = tempfile.mkdtemp(prefix="vault-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(DATABASE_DIR, 'test.db')}")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("JWT_KEY", "test-jwt-key-that-is-long-enough-for-hs256")
+os.environ.setdefault("HASH_POOL_WORKERS", "0")
+os.environ.setdefault("LOGIN_RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("VAULT_CACHE_ENABLED", "false")
+os.environ.setdefault("ATTACHMENT_PATH", os.path.join(DATABASE_DIR, "attachments"))
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture
+def app():
+    from app import create_app
+    from extensions import db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Registers a user and returns the headers to make requests as them
+@pytest.fixture
+def auth_headers(client):
+    client.post("/api/register", json={"username": "alice", "email": "alice@example.com", "password": "Password1!", "passwordConfirm": "Password1!"})
+    token = client.post("/api/login", json={"username": "alice", "password": "Password1!"}).json["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,20 @@
+from extensions import db
+from models import Password
+
+
+# Replaces a stored entry with a "v2:" value that fails authentication
+def corrupt(password_id):
+    db.session.execute(db.update(Password).where(Password.id == password_id).values(password="v2:" + "A" * 40))
+    db.session.commit()
+
+
+def test_audit_reports_corrupted_entry_as_unreadable(client, auth_headers):
+    for number in range(3):
+        client.post("/api/passwords", json={"account_name": f"site {number}", "username": "alice", "password": "secret"}, headers=auth_headers)
+    corrupt(2)
+
+    response = client.get("/api/audit", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.json["total"] == 3
+    assert response.json["unreadable"] == [2]
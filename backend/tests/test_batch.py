@@ -0,0 +1,32 @@
+import pytest
+
+
+def batch(client, headers, *operations):
+    return client.post("/api/batch", json={"operations": list(operations)}, headers=headers)
+
+
+def test_batch_creates_and_reports_ids(client, auth_headers):
+    response = batch(
+        client, auth_headers,
+        {"op": "create", "type": "folder", "name": "work"},
+        {"op": "create", "type": "password", "account_name": "site", "username": "alice", "password": "secret"},
+    )
+
+    assert response.status_code == 200
+    assert [item["index"] for item in response.json["created"]] == [0, 1]
+
+
+@pytest.mark.parametrize("operation, field", [
+    ({"op": "create", "type": "folder", "name": 5}, "name"),
+    ({"op": "update", "type": "folder", "id": [1], "name": "work"}, "id"),
+    ({"op": "delete", "type": "password", "id": {"id": 1}}, "id"),
+    ({"op": "create", "type": "password", "account_name": "site", "username": "alice", "password": "secret", "folder_id": [1]}, "folder_id"),
+    ({"op": "create", "type": "folder", "name": "work", "parent_id": "1"}, "parent_id"),
+    ({"op": "create", "type": "password", "account_name": "site", "username": "alice", "password": 1234}, "password"),
+])
+def test_batch_rejects_fields_of_the_wrong_type(client, auth_headers, operation, field):
+    response = batch(client, auth_headers, {"op": "create", "type": "folder", "name": "ok"}, operation)
+
+    assert response.status_code == 400
+    assert response.json["index"] == 1
+    assert response.json["msg"].startswith(field)
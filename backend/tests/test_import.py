@@ -0,0 +1,34 @@
+import json
+
+
+def test_rows_with_wrong_types_are_reported(client, auth_headers):
+    rows = [
+        {"account_name": "a", "username": "u", "password": "p"},
+        {"account_name": "b", "username": "u", "password": 1234},
+        {"account_name": ["c"], "username": "u", "password": "p"},
+        {"account_name": "d", "username": "u", "password": "p"},
+    ]
+    response = client.post("/api/import", data="\n".join(json.dumps(row) for row in rows), headers=auth_headers, content_type="application/x-ndjson")
+
+    assert response.status_code == 200
+    assert response.json["imported"] == 2
+    assert [error["row"] for error in response.json["errors"]] == [2, 3]
+
+
+def test_body_that_is_not_utf8_is_reported(client, auth_headers):
+    body = "account_name,username,password\na,u,p\n".encode() + b"b,u,\xff\xfe\n"
+    response = client.post("/api/import", data=body, headers=auth_headers, content_type="text/csv")
+
+    assert response.status_code == 200
+    assert response.json["errors"][-1]["msg"].startswith("Row could not be read")
+
+
+def test_csv_error_is_reported(client, auth_headers):
+    # Fields over the csv module's size limit raise csv.Error
+    body = 'account_name,username,password\na,u,p\nb,u,"' + "x" * 200000 + '"\n'
+    response = client.post("/api/import", data=body, headers=auth_headers, content_type="text/csv")
+
+    assert response.status_code == 200
+    assert response.json["imported"] == 1
+    assert response.json["errors"] == [{"row": 2, "msg": response.json["errors"][0]["msg"]}]
+    assert response.json["errors"][0]["msg"].startswith("Row could not be read")
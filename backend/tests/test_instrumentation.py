@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from config import Config
+from extensions import db
+
+
+def test_failed_statement_does_not_leave_a_start_time(app):
+    with db.engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text("SELECT * FROM no_such_table"))
+        connection.execute(text("SELECT 1"))
+
+        assert connection.info["query_start"] == {}
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/api/pool_stats"])
+def test_metrics_need_the_token(client, monkeypatch, path):
+    assert client.get(path).status_code == 404
+
+    monkeypatch.setattr(Config, "METRICS_TOKEN", "scrape-token")
+    assert client.get(path).status_code == 404
+    assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 404
+    assert client.get(path, headers={"Authorization": "Bearer scrape-token"}).status_code == 200
@@ -0,0 +1,48 @@
+import pytest
+
+from extensions import db
+from models import User
+
+
+def login(client, password):
+    return client.post("/api/login", json={"username": "alice", "password": password})
+
+
+def test_failed_logins_lock_the_account(client, auth_headers):
+    for _ in range(5):
+        assert login(client, "wrong").json["msg"] == "Username or password is incorrect"
+
+    db.session.expire_all()
+    user = db.session.get(User, 1)
+    assert user.failed_attempts == 5
+
+    # Locked for 30 minutes, even with the right password
+    response = login(client, "Password1!")
+    assert response.status_code == 400
+    assert "access_token" not in response.json
+
+
+def test_successful_login_resets_failed_attempts(client, auth_headers):
+    for _ in range(3):
+        login(client, "wrong")
+
+    assert "access_token" in login(client, "Password1!").json
+    db.session.expire_all()
+    assert db.session.get(User, 1).failed_attempts == 0
+
+
+@pytest.mark.parametrize("body", [
+    {"username": 1234, "password": "Password1!"},
+    {"username": ["alice"], "password": "Password1!"},
+    {"username": "alice", "password": {"value": "Password1!"}},
+])
+def test_login_rejects_non_string_credentials(client, body):
+    assert client.post("/api/login", json=body).status_code == 400
+
+
+@pytest.mark.parametrize("field", ["username", "email", "password", "passwordConfirm"])
+def test_register_rejects_non_string_fields(client, field):
+    body = {"username": "bobby", "email": "bobby@example.com", "password": "Password1!", "passwordConfirm": "Password1!"}
+    body[field] = 12345678
+
+    assert client.post("/api/register", json=body).status_code == 400
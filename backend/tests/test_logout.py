@@ -0,0 +1,7 @@
+def test_login_right_after_logging_out_everywhere(client, auth_headers):
+    assert client.post("/api/logout", json={"all": True}, headers=auth_headers).status_code == 200
+    assert client.get("/api/check_token", headers=auth_headers).status_code == 401
+
+    token = client.post("/api/login", json={"username": "alice", "password": "Password1!"}).json["access_token"]
+
+    assert client.get("/api/check_token", headers={"Authorization": f"Bearer {token}"}).status_code == 200
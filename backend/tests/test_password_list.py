@@ -0,0 +1,53 @@
+import json
+
+from sqlalchemy import event
+
+import pytest
+
+from extensions import db
+from models import Folder
+
+
+# Statements the database runs while a request is served
+def count_statements(client, path, headers):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.get(path, headers=headers)
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return len(statements)
+
+# Adds folders, some nested, each holding a couple of passwords
+def add_folders(client, headers, count):
+    for number in range(count):
+        parent_id = db.session.query(Folder.id).order_by(Folder.id.desc()).limit(1).scalar() if number % 2 else None
+        client.post("/api/folders", json={"name": f"folder {number}", "parent_id": parent_id}, headers=headers)
+        folder_id = db.session.query(Folder.id).order_by(Folder.id.desc()).limit(1).scalar()
+        for entry in range(2):
+            client.post("/api/passwords", json={"account_name": f"site {number}.{entry}", "username": "alice", "password": "secret", "folder_id": folder_id}, headers=headers)
+    db.session.remove()
+
+
+@pytest.mark.parametrize("accept", ["application/json", "application/vnd.vault.compact+json"])
+def test_password_list_statements_do_not_grow_with_folders(client, auth_headers, accept):
+    headers = dict(auth_headers, Accept=accept)
+    client.post("/api/passwords", json={"account_name": "unfiled", "username": "alice", "password": "secret"}, headers=headers)
+
+    add_folders(client, headers, 1)
+    one_folder = count_statements(client, "/api/password_list", headers)
+
+    add_folders(client, headers, 20)
+    many_folders = count_statements(client, "/api/password_list", headers)
+
+    assert many_folders == one_folder
+    vault = json.loads(client.get("/api/password_list", headers=headers).get_data())
+    assert (len(vault["folders"]), len(vault["passwords"])) == (21, 1)
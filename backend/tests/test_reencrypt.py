@@ -0,0 +1,19 @@
+from extensions import db
+from models import Password, ReencryptionJob, User
+import reencrypt
+
+
+def test_job_fails_on_corrupted_gcm_entry(client, auth_headers):
+    for number in range(3):
+        client.post("/api/passwords", json={"account_name": f"site {number}", "username": "alice", "password": "secret"}, headers=auth_headers)
+    db.session.execute(db.update(Password).where(Password.id == 2).values(password="v2:" + "A" * 40))
+    db.session.commit()
+
+    job = reencrypt.rotate_salt(db.session.get(User, 1))
+    messages = []
+
+    assert reencrypt.run_job(job.id, progress=messages.append) == (job.id, "failed")
+    job = db.session.get(ReencryptionJob, job.id)
+    assert job.status == "failed"
+    assert job.error.startswith("Could not decrypt password 2")
+    assert messages == [f"job {job.id}: {job.error}"]
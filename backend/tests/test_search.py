@@ -0,0 +1,54 @@
+from sqlalchemy import text
+
+from extensions import db
+import search
+
+
+def login(client, username):
+    client.post("/api/register", json={"username": username, "email": f"{username}@example.com", "password": "Password1!", "passwordConfirm": "Password1!"})
+    token = client.post("/api/login", json={"username": username, "password": "Password1!"}).json["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def names(client, headers, query):
+    response = client.get("/api/search", query_string={"q": query}, headers=headers)
+    assert response.status_code == 200
+    return [entry["name"] for entry in response.json["passwords"]]
+
+
+def test_search_only_sees_own_rows(client, auth_headers):
+    bobby = login(client, "bobby")
+    client.post("/api/folders", json={"name": "work"}, headers=auth_headers)
+    client.post("/api/passwords", json={"account_name": "github", "username": "alice", "password": "p"}, headers=auth_headers)
+    client.post("/api/passwords", json={"account_name": "mygithub", "username": "alice", "password": "p", "folder_id": 1}, headers=auth_headers)
+    client.post("/api/passwords", json={"account_name": "github", "username": "bobby", "password": "p"}, headers=bobby)
+
+    assert names(client, auth_headers, "github") == ["github", "mygithub"]
+    assert names(client, bobby, "github") == ["github"]
+
+
+def test_index_follows_renames_moves_and_deletes(client, auth_headers):
+    client.post("/api/folders", json={"name": "work"}, headers=auth_headers)
+    client.post("/api/passwords", json={"account_name": "gitlab", "username": "alice", "password": "p"}, headers=auth_headers)
+    client.patch("/api/passwords", json={"id": 1, "account_name": "bitbucket", "username": "alice", "password": "p"}, headers=auth_headers)
+    assert names(client, auth_headers, "gitlab") == []
+    assert names(client, auth_headers, "bitbucket") == ["bitbucket"]
+
+    client.post("/api/batch", json={"operations": [{"op": "move", "type": "password", "id": 1, "folder_id": 1}]}, headers=auth_headers)
+    assert names(client, auth_headers, "bitbucket") == ["bitbucket"]
+
+    # Deleting the folder removes its passwords from the index along with it
+    client.delete("/api/folders", query_string={"id": 1}, headers=auth_headers)
+    assert names(client, auth_headers, "bitbucket") == []
+    assert db.session.execute(text("SELECT COUNT(*) FROM password_fts")).scalar() == 0
+
+
+def test_rebuild_replaces_an_index_without_owners(client, auth_headers):
+    client.post("/api/passwords", json={"account_name": "github", "username": "alice", "password": "p"}, headers=auth_headers)
+    with db.engine.begin() as connection:
+        for statement in search.SQLITE_DROP:
+            connection.execute(text(statement))
+        connection.execute(text("CREATE VIRTUAL TABLE password_fts USING fts5(account_name, username, content='password', content_rowid='id', tokenize='trigram')"))
+
+    search.rebuild_index()
+
+    assert names(client, auth_headers, "github") == ["github"]
@@ -0,0 +1,29 @@
+import base64
+import os
+
+import pytest
+
+import utils
+
+
+@pytest.mark.parametrize("gcm", [False, True])
+def test_round_trip(gcm):
+    key = os.urandom(32)
+    assert utils.decrypt(utils.encrypt("secret", key, gcm), key) == "secret"
+
+
+def test_tampered_gcm_value_raises_value_error():
+    key = os.urandom(32)
+    raw = bytearray(base64.b64decode(utils.encrypt("secret", key, gcm=True)[len(utils.ENVELOPE_GCM):]))
+    raw[-1] ^= 1
+    tampered = utils.ENVELOPE_GCM + base64.b64encode(bytes(raw)).decode()
+
+    with pytest.raises(ValueError):
+        utils.decrypt(tampered, key)
+
+
+def test_gcm_value_with_wrong_key_raises_value_error():
+    value = utils.encrypt("secret", os.urandom(32), gcm=True)
+
+    with pytest.raises(ValueError):
+        utils.decrypt_many([value], os.urandom(32))
@@ -1,10 +1,12 @@
-import pytz
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes, padding
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
 import os
 import base64
+from instrumentation import timed_function
 
 # Creates a decrytion/encryption key using master password
 def derive_key(password: str, salt: bytes) -> bytes:
@@ -18,21 +20,98 @@ def derive_key(password: str, salt: bytes) -> bytes:
     key = kdf.derive(password.encode())
     return key
 
-# Encrypts user's stored passwords
-def encrypt(password: str, key: bytes) -> str:
+# Prefix marking AES-GCM envelopes, older values are bare base64 IV + AES-CBC
+ENVELOPE_GCM = "v2:"
+
+def _encrypt_cbc(aes, password):
     iv = os.urandom(16)  # 16 bytes for AES-CBC
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
-    
+    encryptor = Cipher(aes, modes.CBC(iv), backend=default_backend()).encryptor()
+
     padder = padding.PKCS7(algorithms.AES.block_size).padder()
     padded_password = padder.update(password.encode()) + padder.finalize()
-    
+
     encrypted_password = encryptor.update(padded_password) + encryptor.finalize()
-    
+
     return base64.b64encode(iv + encrypted_password).decode('utf-8')
 
+def _decrypt_cbc(aes, ciphertext):
+    raw = base64.b64decode(ciphertext)
+    decryptor = Cipher(aes, modes.CBC(raw[:16]), backend=default_backend()).decryptor()
+    padded_password = decryptor.update(raw[16:]) + decryptor.finalize()
+
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    return (unpadder.update(padded_password) + unpadder.finalize()).decode()
+
+def _encrypt_gcm(aesgcm, password):
+    nonce = os.urandom(12)
+    return ENVELOPE_GCM + base64.b64encode(nonce + aesgcm.encrypt(nonce, password.encode(), None)).decode('utf-8')
+
+def _decrypt_gcm(aesgcm, ciphertext):
+    raw = base64.b64decode(ciphertext[len(ENVELOPE_GCM):])
+    # A wrong key or tampered value fails as ValueError, the same as a bad CBC value
+    try:
+        return aesgcm.decrypt(raw[:12], raw[12:], None).decode()
+    except InvalidTag:
+        raise ValueError("Encrypted value could not be authenticated") from None
+
+# Encrypts a list of passwords with one key setup, as AES-GCM envelopes when gcm is True
+def encrypt_many(passwords: list, key: bytes, gcm: bool = False) -> list:
+    if gcm:
+        aesgcm = AESGCM(key)
+        return [_encrypt_gcm(aesgcm, password) for password in passwords]
+    aes = algorithms.AES(key)
+    return [_encrypt_cbc(aes, password) for password in passwords]
+
+# Decrypts a list of stored passwords in either format with one key setup
+def decrypt_many(ciphertexts: list, key: bytes) -> list:
+    aes = algorithms.AES(key)
+    aesgcm = AESGCM(key)
+    return [
+        _decrypt_gcm(aesgcm, ciphertext) if ciphertext.startswith(ENVELOPE_GCM) else _decrypt_cbc(aes, ciphertext)
+        for ciphertext in ciphertexts
+    ]
+
+# Encrypts user's stored passwords
+@timed_function("encrypt")
+def encrypt(password: str, key: bytes, gcm: bool = False) -> str:
+    return encrypt_many([password], key, gcm)[0]
+
+# Decrypts a stored password in either format
+def decrypt(ciphertext: str, key: bytes) -> str:
+    return decrypt_many([ciphertext], key)[0]
+
+# Returns an error message if an account's fields are invalid, otherwise None
+def validate_account(account_name, username, password):
+    # Makes sure none of the input is blank
+    if not account_name or not username or not password:
+        return "All fields are required"
+
+    # Makes sure the account_name, username, and password are valid
+    if len(account_name) > 50:
+        return "Account name must be below 50 characters"
+    if len(username) > 50:
+        return "Username must be below 50 characters"
+    if len(password) > 50:
+        return "Password must be below 50 characters"
+
+    return None
+
+# Encodes a keyset position into an opaque page cursor
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(":".join(str(value) for value in values).encode()).decode('utf-8')
+
+# Decodes a page cursor back into its integer keyset position
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        return tuple(int(value) for value in base64.urlsafe_b64decode(cursor.encode()).decode().split(":"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
 # Converts stored time to user's timezone
 def convert_to_timezone(date, timezone):
+    # Imported here so pytz is only loaded when a conversion is needed
+    import pytz
+
     if timezone not in pytz.all_timezones:
         return date
 
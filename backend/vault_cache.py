@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from config import Config
+import os
+import sqlite3
+import threading
+import time
+
+# Entries are keyed by (user_id, variant) and hold the vault_version they were encoded at, so any write that bumps
+# the version makes the entry stale without anything having to find and delete it. A variant is a response format
+# and content encoding, e.g. "compact:gzip".
+
+# Changes whenever the encoded response changes shape, so bodies stored by an older release are never served
+FORMAT = 1
+
+# Encoded vault responses held in this process, evicting the least recently used once over max_bytes
+class MemoryStore:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Body stored for a key at this version, or None
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, body)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        self.bytes -= len(self._entries.pop(key)[1])
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+# Encoded vault responses in a SQLite file so every worker on a host can reuse each other's work
+class SqliteStore:
+    def __init__(self, path, max_bytes, prune_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._puts = 0
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS vault_cache "
+            "(user_id INTEGER, variant TEXT, version INTEGER, body BLOB, used_at REAL, PRIMARY KEY (user_id, variant))"
+        )
+
+    # One connection per thread and process, a connection inherited from before a fork is never reused
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key, version):
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT body FROM vault_cache WHERE user_id = ? AND variant = ? AND version = ?", (*key, version)
+        ).fetchone()
+        if row is None:
+            return None
+        # Hits here are copied into the worker's memory store, so this write happens once per worker, not per request
+        connection.execute("UPDATE vault_cache SET used_at = ? WHERE user_id = ? AND variant = ?", (time.time(), *key))
+        return row[0]
+
+    def put(self, key, version, body):
+        if len(body) > self.max_bytes:
+            return
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO vault_cache (user_id, variant, version, body, used_at) VALUES (?, ?, ?, ?, ?)",
+            (*key, version, body, time.time())
+        )
+        self._puts += 1
+        if self._puts % self.prune_every == 0:
+            self.prune()
+
+    # Drops the least recently used bodies beyond max_bytes
+    def prune(self):
+        self._connect().execute(
+            "DELETE FROM vault_cache WHERE (user_id, variant) IN ("
+            "SELECT user_id, variant FROM (SELECT user_id, variant, SUM(LENGTH(body)) OVER (ORDER BY used_at DESC) AS total "
+            "FROM vault_cache) WHERE total > ?)",
+            (self.max_bytes,)
+        )
+
+    def stats(self):
+        count, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM vault_cache").fetchone()
+        return {"shared_entries": count, "shared_bytes": size}
+
+# Per worker memory store in front of an optional shared store
+class VaultCache:
+    def __init__(self, memory, shared=None):
+        self.memory = memory
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    # Encoded body of a user's vault at a version, or None when it has to be built
+    def get(self, user_id, version, variant):
+        key = (user_id, f"{FORMAT}:{variant}")
+        body = self.memory.get(key, version)
+        if body is not None:
+            self.hits += 1
+            return body
+
+        if self.shared is not None:
+            body = self.shared.get(key, version)
+            if body is not None:
+                self.shared_hits += 1
+                self.memory.put(key, version, body)
+                return body
+
+        self.misses += 1
+        return None
+
+    def put(self, user_id, version, variant, body):
+        key = (user_id, f"{FORMAT}:{variant}")
+        self.memory.put(key, version, body)
+        if self.shared is not None:
+            self.shared.put(key, version, body)
+
+    def stats(self):
+        stats = {"hits": self.hits, "shared_hits": self.shared_hits, "misses": self.misses, **self.memory.stats()}
+        if self.shared is not None:
+            stats.update(self.shared.stats())
+        return stats
+
+
+def create_cache():
+    shared = SqliteStore(Config.VAULT_CACHE_SQLITE_PATH, Config.VAULT_CACHE_MAX_BYTES) if Config.VAULT_CACHE_STORE == "sqlite" else None
+    return VaultCache(MemoryStore(Config.VAULT_CACHE_MAX_BYTES), shared)
+
+vault_cache = create_cache()
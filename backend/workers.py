@@ -0,0 +1,133 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from config import Config
+import multiprocessing
+import bcrypt
+import os
+import threading
+import time
+import utils
+from instrumentation import timed_function
+
+# Raised when the hashing pool queue is full so requests can fail fast with a 503
+class PoolSaturated(Exception):
+    pass
+
+# Runs in a worker process and reports when it started so the parent can measure queue wait
+def _run_timed(fn, args):
+    return time.time(), fn(*args)
+
+def _check_password(password_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+# Bounded process pool for CPU heavy hashing and key derivation
+class HashPool:
+    def __init__(self, workers, queue_size, timeout, start_method):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.start_method = start_method
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+        self._lock = threading.Lock()
+
+    # Creates the executor on first use, and again in each forked server worker
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context(self.start_method)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pid = os.getpid()
+            return self._executor
+
+    # Runs fn in the pool, or inline when the pool is disabled
+    def run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        # Rejects straight away instead of queueing behind a login storm
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolSaturated()
+
+        with self._lock:
+            self.in_flight += 1
+            self.submitted += 1
+
+        submitted_at = time.time()
+        try:
+            future = self._get_executor().submit(_run_timed, fn, args)
+        except BaseException:
+            self._finish(None)
+            raise
+        # The slot is held until the job ends, a job that outlived its caller's timeout still occupies a worker
+        future.add_done_callback(self._finish)
+
+        try:
+            started_at, result = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Drops the job if it hasn't started yet
+            future.cancel()
+            with self._lock:
+                self.rejected += 1
+            raise PoolSaturated()
+
+        wait = max(0.0, started_at - submitted_at)
+        with self._lock:
+            self.completed += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        return result
+
+    # Frees a job's slot once it has finished, failed or been cancelled
+    def _finish(self, future):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "in_flight": self.in_flight,
+                "queue_depth": max(0, self.in_flight - self.workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_avg_ms": round(self.wait_total / self.completed * 1000, 3) if self.completed else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+hash_pool = HashPool(
+    workers=Config.HASH_POOL_WORKERS,
+    queue_size=Config.HASH_POOL_QUEUE,
+    timeout=Config.HASH_POOL_TIMEOUT,
+    start_method=Config.HASH_POOL_START_METHOD
+)
+
+# Checks a password against its bcrypt hash in the pool
+@timed_function("bcrypt")
+def check_password(password_hash, password):
+    return hash_pool.run(_check_password, password_hash, password)
+
+# Hashes a new password with bcrypt in the pool
+@timed_function("bcrypt")
+def hash_password(password, rounds=12):
+    return hash_pool.run(_hash_password, password, rounds)
+
+# Derives a vault key in the pool
+@timed_function("kdf")
+def derive_key(password, salt):
+    return hash_pool.run(utils.derive_key, password, salt)
@@ -0,0 +1,4 @@
+from app import create_app
+
+# Entry point for WSGI servers, safe to preload before forking workers
+app = create_app()
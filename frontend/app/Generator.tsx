@@ -15,6 +15,10 @@ import { FontAwesome6 } from "@expo/vector-icons";
 import StatusMessage from "@/components/StatusMessage";
 import Collapsible from "react-native-collapsible";
 import * as Clipboard from "expo-clipboard";
+import * as Crypto from "expo-crypto";
+import AsyncStorage from "@react-native-async-storage/async-storage";
+import axios from "axios";
+import config from "@/config";
 
 export default function Generator() {
   const { height, width } = useWindowDimensions(); // Window height and width
@@ -25,6 +29,7 @@ export default function Generator() {
   const [trailing, setTrailing] = useState(1); // Number of trailing characters
   const [generatedPass, setGeneratedPass] = useState(""); // Generated password
   const [copied, setCopied] = useState(false); // Copied status
+  const [breachMsg, setBreachMsg] = useState(""); // Warning when the generated password is breached
 
   // Copies generated password to user clipboard
   async function copyToClipboard() {
@@ -49,6 +54,32 @@ export default function Generator() {
       result += trailers.charAt(Math.floor(Math.random() * trailers.length));
     }
     setGeneratedPass(result);
+    checkBreached(result);
+  }
+
+  // Checks the password against the breach index by sending only the first 5 characters of its SHA-1
+  async function checkBreached(password: string) {
+    setBreachMsg("");
+    const hash = (
+      await Crypto.digestStringAsync(Crypto.CryptoDigestAlgorithm.SHA1, password)
+    ).toUpperCase();
+    const token = await AsyncStorage.getItem("authToken");
+    try {
+      const response = await axios.get(`${config.API_URL}/api/breach_check`, {
+        params: { prefix: hash.slice(0, 5) },
+        headers: {
+          Authorization: `Bearer ${token}`,
+        },
+      });
+      const count = response.data.suffixes[hash.slice(5)];
+      if (count) {
+        setBreachMsg(
+          `This password has appeared ${count} times in known data breaches, generate another one`
+        );
+      }
+    } catch (error) {
+      // Breach checks are best effort and never block generating a password
+    }
   }
 
   return (
@@ -137,6 +168,13 @@ export default function Generator() {
             />
           </View>
         ) : null}
+        <Collapsible collapsed={breachMsg === ""}>
+          <StatusMessage
+            statusMessage={breachMsg}
+            style={{ marginTop: 10 }}
+            onClear={() => setBreachMsg("")}
+          />
+        </Collapsible>
         <Collapsible collapsed={copied == false}>
           <StatusMessage
             severity="success"
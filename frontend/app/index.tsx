@@ -288,6 +288,15 @@ export default function App() {
         }
       );
       isFolder(display) ? setDisplay(null) : null, setCreated(created + 1);
+
+      // Keeps the menu open to show the breach warning, cleared so it isn't added twice
+      if (response.data.warning) {
+        setNewAccount("");
+        setNewUsername("");
+        setNewPass("");
+        setErrorMsg(response.data.warning);
+        return;
+      }
       setCreateMenu(false);
     } catch (error) {
       if (error instanceof AxiosError) {
@@ -325,7 +334,7 @@ export default function App() {
           },
         }
       );
-      setErrorMsg("");
+      setErrorMsg(response.data.warning ?? "");
       setSuccessMsg(response.data.msg);
       setCreated(created + 1);
     } catch (error) {
@@ -145,6 +145,21 @@ export function UserProvider({ children }: Props) {
   };
 
   const logoutUser = async () => {
+    // Revokes the token on the server, already expired or revoked tokens are ignored
+    const storedToken = await AsyncStorage.getItem("authToken");
+    if (storedToken) {
+      try {
+        await axios.post(
+          `${config.API_URL}/api/logout`,
+          {},
+          {
+            headers: {
+              Authorization: `Bearer ${storedToken}`,
+            },
+          }
+        );
+      } catch (error) {}
+    }
     await AsyncStorage.removeItem("user");
     await AsyncStorage.removeItem("authToken");
     await AsyncStorage.removeItem("key");